@@ -0,0 +1,366 @@
+# benchmark.py
+
+import argparse
+import ctypes
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import torch
+import torch.nn as nn
+import torch_geometric
+
+from main_gae import build_parser
+from synthetic_data import SYNTHETIC_GRAPHS, synthetic_working_dir
+from train_hetero_gae import prepare_split, build_model, build_optimizer, train_step, compile_model
+
+
+def time_epochs(net, train_data, edge_types, args):
+    """
+    Mean and standard deviation of the wall time of a training epoch, after args.warmup_epochs untimed epochs.
+    """
+    loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+    optimizer = build_optimizer(net.parameters(), args)
+    times = []
+    for epoch in range(args.warmup_epochs + args.bench_epochs):
+        start = time.time()
+        train_step(net, optimizer, loss_fn, train_data, edge_types, args.device)
+        if epoch >= args.warmup_epochs:
+            times.append(time.time() - start)
+    times = torch.tensor(times)
+    return times.mean().item(), times.std().item() if len(times) > 1 else 0.0
+
+
+def benchmark_compile(args):
+    """
+    Per-epoch training time of the eager model against the torch.compile'd one, from the same initialization.
+    """
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+
+    results = {}
+    for mode in ["eager", "compile"]:
+        torch_geometric.seed_everything(args.seed)
+        net = build_model(data, train_data, args)
+        if mode == "compile":
+            start = time.time()
+            compile_model(net, train_data, edge_types)
+            print(f"Compilation and parity check: {time.time() - start:.1f}s")
+        results[mode] = time_epochs(net, train_data, edge_types, args)
+        print(f"| {mode} | epoch time: {results[mode][0]:.4f}s +- {results[mode][1]:.4f}s")
+    print(f"Speedup: {results['eager'][0] / results['compile'][0]:.2f}x")
+    return results
+
+
+def peak_rss_increase(fn, interval=0.001):
+    """
+    Runs fn() and returns its result and the peak increase of the resident set size (bytes) during the call,
+    sampled from /proc/self/statm (Linux) every interval seconds. Freed heap memory is first handed back to the
+    system with glibc's malloc_trim, so memory released by earlier steps does not hide the growth.
+    """
+    ctypes.CDLL("libc.so.6").malloc_trim(0)
+    page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def rss():
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * page_size
+
+    baseline = rss()
+    peak = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], rss())
+            time.sleep(interval)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        result = fn()
+    finally:
+        done.set()
+        sampler.join()
+    return result, max(peak[0], rss()) - baseline
+
+
+def benchmark_checkpointing(args):
+    """
+    Peak memory of a training step and per-epoch time without activation checkpointing, and with
+    checkpointing per group of args.checkpoint_group_size relations.
+    """
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+
+    results = {}
+    for mode in ["none", "relation"]:
+        torch_geometric.seed_everything(args.seed)
+        net = build_model(data, train_data, argparse.Namespace(**{**vars(args), "checkpoint_activations": mode}))
+        loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+        optimizer = build_optimizer(net.parameters(), args)
+        train_step(net, optimizer, loss_fn, train_data, edge_types, args.device)  # lazy init and optimizer state
+        _, peak = peak_rss_increase(lambda: train_step(net, optimizer, loss_fn, train_data, edge_types, args.device))
+        epoch_time, epoch_std = time_epochs(net, train_data, edge_types, args)
+        results[mode] = (peak, epoch_time)
+        print(f"| {mode} | peak memory of a step: {peak / 2**20:.1f} MiB | epoch time: {epoch_time:.4f}s "
+              f"+- {epoch_std:.4f}s")
+    print(f"relation: {results['relation'][0] / max(results['none'][0], 1):.2f}x memory, "
+          f"{results['relation'][1] / results['none'][1]:.2f}x time")
+    return results
+
+
+def benchmark_replicas(args):
+    """
+    Per-epoch training time of args.num_replicas seeds trained one after the other against the same seeds
+    trained as one stacked, vmapped model (train_replicas.py).
+    """
+    from train_replicas import build_replicas, stacked_train_step
+
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+    seeds = [args.seed + replica for replica in range(args.num_replicas)]
+
+    single, _ = time_epochs(build_model(data, train_data, args), train_data, edge_types, args)
+    replicas = build_replicas(data, train_data, seeds, args)
+    optimizer = build_optimizer(replicas.params.values(), args)
+    times = []
+    for epoch in range(args.warmup_epochs + args.bench_epochs):
+        start = time.time()
+        stacked_train_step(replicas, optimizer, train_data, edge_types)
+        if epoch >= args.warmup_epochs:
+            times.append(time.time() - start)
+    stacked = sum(times) / len(times)
+    print(f"| 1 seed | epoch time: {single:.4f}s")
+    print(f"| {len(seeds)} seeds sequentially (estimated) | epoch time: {len(seeds) * single:.4f}s")
+    print(f"| {len(seeds)} seeds stacked | epoch time: {stacked:.4f}s")
+    print(f"Throughput relative to one seed: {len(seeds) * single / stacked:.2f} seed-epochs per seed-epoch time")
+    return single, stacked
+
+
+def benchmark_sign(args):
+    """
+    Per-epoch training time and test metrics of HeteroGAE against SIGNGAE (--encoder sign) on the split of
+    args.seed, with the time of the first encode, which for SIGNGAE includes computing the propagation operators
+    (without the disk cache).
+    """
+    from train_hetero_gae import run_experiment
+
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+
+    results = {}
+    for encoder in ["gae", "sign"]:
+        encoder_args = argparse.Namespace(**{**vars(args), "encoder": encoder, "sign_cache_dir": None})
+        torch_geometric.seed_everything(args.seed)
+        net = build_model(data, train_data, encoder_args)
+        start = time.time()
+        with torch.no_grad():
+            net.encode(train_data.x_dict, train_data.edge_index_dict)
+        first_encode = time.time() - start
+        epoch_time, epoch_std = time_epochs(net, train_data, edge_types, encoder_args)
+        results[encoder] = (first_encode, epoch_time, epoch_std, run_experiment(args.seed, encoder_args))
+    for encoder, (first_encode, epoch_time, epoch_std, result) in results.items():
+        print(f"| {encoder} | first encode: {first_encode:.2f}s | epoch time: {epoch_time:.4f}s +- {epoch_std:.4f}s "
+              f"| Test AUROC: {result['auroc']:.4f} | Test AUPRC: {result['auprc']:.4f} "
+              f"| Test AP@50: {result['ap50']:.4f} |")
+    print(f"Epoch speedup: {results['gae'][1] / results['sign'][1]:.2f}x")
+    return results
+
+
+def benchmark_prune_genes(args):
+    """
+    Encoder time, training step memory and epoch time of the drug-drug objective on the full graph against the
+    graph pruned to the receptive field of the drug embeddings (--prune_genes), on the same split.
+    """
+    from optim import memory_report
+
+    results = {}
+    for prune in [False, True]:
+        prune_args = argparse.Namespace(**{**vars(args), "prune_genes": prune})
+        torch_geometric.seed_everything(args.seed)
+        data, train_data, valid_data, test_data = prepare_split(prune_args)
+        drug_edge_types = [edge_type for edge_type in data.edge_types
+                           if edge_type[1] not in ["interact", "has_target", "get_target"]]
+        torch_geometric.seed_everything(args.seed)
+        net = build_model(data, train_data, prune_args)
+        loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+        optimizer = build_optimizer(net.parameters(), prune_args)
+        train_step(net, optimizer, loss_fn, train_data, drug_edge_types, args.device)  # lazy init and optimizer state
+        _, peak = peak_rss_increase(lambda: train_step(net, optimizer, loss_fn, train_data, drug_edge_types,
+                                                       args.device))
+        net.eval()
+        times = []
+        with torch.no_grad():
+            for _ in range(args.bench_epochs):
+                start = time.time()
+                net.encode(test_data.x_dict, test_data.edge_index_dict)
+                times.append(time.time() - start)
+        encode_time = sum(times) / len(times)
+        epoch_time, epoch_std = time_epochs(net, train_data, drug_edge_types, prune_args)
+        param_bytes = sum(entry["params"] for entry in memory_report(net).values())
+        name = "pruned" if prune else "full"
+        results[name] = (peak, encode_time, epoch_time, param_bytes)
+        print(f"| {name} | genes: {data['gene'].num_nodes} | PPI edges: {data['gene', 'interact', 'gene'].num_edges} "
+              f"| parameters: {param_bytes / 2**20:.1f} MiB | peak memory of a step: {peak / 2**20:.1f} MiB "
+              f"| test encode: {encode_time:.4f}s | epoch time: {epoch_time:.4f}s +- {epoch_std:.4f}s |")
+    print(f"pruned: {results['pruned'][3] / results['full'][3]:.2f}x parameters, "
+          f"{results['pruned'][0] / max(results['full'][0], 1):.2f}x step memory, "
+          f"{results['pruned'][1] / results['full'][1]:.2f}x encode time, "
+          f"{results['pruned'][2] / results['full'][2]:.2f}x epoch time")
+    return results
+
+
+def benchmark_prefetch(args):
+    """
+    Per-epoch training time with the supervision batch sampled inline, by pyg_utils.negative_sampling (the
+    default) or by sample_negative_edges (the sampler of --prefetch), and prefetched in a background thread
+    (--prefetch, depth at least 1), with the time of sampling a batch alone (medians over args.bench_epochs).
+    Prefetching only hides the sampling time as far as the sampler and the training step release the GIL and
+    have cores to run on.
+    """
+    from sampling import EdgeLabelPrefetcher
+    from train_hetero_gae import sample_edge_labels
+
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+    num_epochs = args.warmup_epochs + args.bench_epochs
+
+    def sample_epoch(epoch):
+        return sample_edge_labels(train_data, edge_types,
+                                  generator=torch.Generator().manual_seed(args.seed * 1000003 + epoch))
+
+    sample_times = []
+    for epoch in range(args.bench_epochs):
+        start = time.time()
+        sample_epoch(epoch)
+        sample_times.append(time.time() - start)
+    sample_time = torch.tensor(sample_times).median().item()
+    print(f"| sampling alone | {sample_time:.4f}s per epoch |")
+
+    results = {}
+    for mode in ["inline pyg", "inline generator", "prefetch"]:
+        torch_geometric.seed_everything(args.seed)
+        net = build_model(data, train_data, args)
+        loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+        optimizer = build_optimizer(net.parameters(), args)
+        prefetcher = EdgeLabelPrefetcher(sample_epoch, num_epochs, depth=max(args.prefetch, 1)) \
+            if mode == "prefetch" else None
+        times = []
+        for epoch in range(num_epochs):
+            start = time.time()
+            if mode == "inline pyg":
+                edge_labels = None  # sampled by train_step
+            elif mode == "inline generator":
+                edge_labels = sample_epoch(epoch)
+            else:
+                edge_labels = prefetcher.get(epoch)
+            train_step(net, optimizer, loss_fn, train_data, edge_types, args.device, edge_labels=edge_labels)
+            if epoch >= args.warmup_epochs:
+                times.append(time.time() - start)
+        if prefetcher is not None:
+            prefetcher.close()
+        results[mode] = torch.tensor(times).median().item()
+        print(f"| {mode} | median epoch time: {results[mode]:.4f}s |")
+    print(f"Prefetching saves {results['inline generator'] - results['prefetch']:.4f}s per epoch of the "
+          f"{sample_time:.4f}s of sampling, {results['inline pyg'] / results['prefetch']:.2f}x the speed of the "
+          f"default inline sampling")
+    return sample_time, results
+
+
+def benchmark_distributed(args):
+    """
+    Per-epoch training time of distributed.py on 1 to args.nproc_per_node ranks of this machine, with the cores
+    split evenly between the ranks. Every rank runs the whole encoder, so only the decoding is parallel.
+    """
+    import torch.multiprocessing as mp
+    from distributed import time_epochs_worker
+
+    results = {}
+    for world_size in range(1, args.nproc_per_node + 1):
+        queue = mp.get_context("spawn").SimpleQueue()
+        mp.spawn(time_epochs_worker, args=(world_size, args, queue), nprocs=world_size)
+        results[world_size] = queue.get()
+        print(f"| {world_size} ranks | epoch time: {results[world_size]:.4f}s "
+              f"| speedup: {results[1] / results[world_size]:.2f}x |")
+    return results
+
+
+def time_in_fresh_interpreter(statement, repeat=3):
+    """
+    Best-of-repeat wall time of running a python statement in a new interpreter, from this directory.
+    """
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(float(output.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+# statement -> budget in seconds on top of "import torch" (None: absolute budget, torch must not be loaded)
+IMPORT_BUDGETS = {
+    "import sys, main_gae; main_gae.build_parser().format_help(); assert 'torch' not in sys.modules": (None, 0.2),
+    "import models.scorer": ("torch", 0.3),
+    "import export_model; export_model.load_scorer": ("torch", 0.3),
+    "import serve": ("torch", 0.3),
+}
+
+
+def benchmark_imports(args):
+    """
+    Import-time budget of the lightweight entry points: the CLI parser must not load torch at all and the
+    scoring path may only add a small overhead on top of torch itself. Exits with status 1 if over budget.
+    """
+    torch_time = time_in_fresh_interpreter("import torch")
+    print(f"| import torch | {torch_time:.3f}s")
+    over_budget = False
+    for statement, (baseline, budget) in IMPORT_BUDGETS.items():
+        elapsed = time_in_fresh_interpreter(statement)
+        overhead = elapsed - torch_time if baseline == "torch" else elapsed
+        within = overhead <= budget
+        over_budget |= not within
+        print(f"| {statement} | {elapsed:.3f}s | overhead {overhead:.3f}s | budget {budget:.3f}s | "
+              f"{'ok' if within else 'OVER BUDGET'}")
+    if over_budget:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "compile": benchmark_compile,
+    "checkpointing": benchmark_checkpointing,
+    "replicas": benchmark_replicas,
+    "sign": benchmark_sign,
+    "prune_genes": benchmark_prune_genes,
+    "prefetch": benchmark_prefetch,
+    "distributed": benchmark_distributed,
+    "imports": benchmark_imports,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of training variants",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--benchmark", type=str, default="compile", choices=list(BENCHMARKS))
+    parser.add_argument("--warmup_epochs", type=int, default=3, help="untimed epochs before measuring")
+    parser.add_argument("--bench_epochs", type=int, default=10, help="number of timed epochs")
+    parser.add_argument("--num_replicas", type=int, default=4, help="number of stacked seeds (replicas benchmark)")
+    parser.add_argument("--nproc_per_node", type=int, default=2, help="largest number of ranks (distributed benchmark)")
+    parser.add_argument("--master_port", type=int, default=29500, help="free local port (distributed benchmark)")
+    parser.add_argument("--synthetic", type=str, default=None, choices=list(SYNTHETIC_GRAPHS),
+                        help="benchmark on a synthetic graph of synthetic_data.py instead of ./Data")
+    parser.add_argument("--synthetic_dir", type=str, default="./synthetic",
+                        help="directory the synthetic graphs are written to")
+    args = parser.parse_args()
+    if args.synthetic is not None:
+        for path in ["chkpt_dir", "sign_cache_dir", "results_dir"]:
+            setattr(args, path, os.path.abspath(getattr(args, path)))
+        os.chdir(synthetic_working_dir(args.synthetic, args.synthetic_dir))  # data.load_data reads ./Data
+    BENCHMARKS[args.benchmark](args)
@@ -1,9 +1,8 @@
-import torch_geometric.utils as pyg_utils
-import torch_geometric.data as pyg_data
-
 import json
+from collections import defaultdict
 
-from utils import *
+from utils import load_ppi, load_targets, load_combo_side_effect, convert_combo_side_effect_to_edge_index_list, \
+    generate_morgan_fingerprint
 
 ppi_path = "./Data/bio-decagon-ppi.csv"
 combo_side_effect_path = "./Data/bio-decagon-combo.csv"
@@ -12,14 +11,19 @@ drug_gene_path = "./Data/bio-decagon-targets.csv"
 mono_side_effect_path = "./Data/bio-decagon-mono.csv"
 
             
-def load_data(randomize_ppi=False, randomize_dpi = False, return_augment =False):
+def load_data(randomize_ppi=False, randomize_dpi = False, return_augment =False, min_side_effect_edges=500):
     """
     Loads and processes different types of biological data to create a PyTorch Geometric Heterogeneous Graph.
+    Side effects with fewer than min_side_effect_edges drug pairs are left out.
 
     Returns a heterogeneous graph with different types of nodes (genes and drugs)
     and relationships (protein-protein, drug-drug, and drug-protein)
 
     """
+    import torch
+    import torch_geometric.data as pyg_data
+    import torch_geometric.utils as pyg_utils
+
     """ protein - protein """
     randomize_ppi = randomize_ppi
     randomize_dpi = randomize_dpi
@@ -41,7 +45,7 @@ def load_data(randomize_ppi=False, randomize_dpi = False, return_augment =False)
     edge_index_dict = defaultdict(list)
 
     drug_2_idx, edge_index_dict = convert_combo_side_effect_to_edge_index_list(
-                                    se_2_combo, combo_2_stitch, stitch_2_idx)
+                                    se_2_combo, combo_2_stitch, stitch_2_idx, min_edges=min_side_effect_edges)
 
     print("Number of side effects in consideration: ", len(edge_index_dict))
 
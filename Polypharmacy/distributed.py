@@ -0,0 +1,214 @@
+# distributed.py
+
+import argparse
+import os
+import random
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import torch_geometric
+
+from main_gae import build_parser
+from metrics import roc_auc_score
+from results_store import append_results, run_config
+from train_hetero_gae import prepare_split, build_model, build_optimizer, train_step, predict_edge_labels, \
+    sample_edge_labels, test_model
+
+
+def shard_edge_types(data, edge_types, rank, world_size):
+    """
+    Assigns the supervised edge types to ranks, largest first to the least loaded rank, so every rank
+    decodes roughly the same number of label edges. "get_target" carries no supervision and is skipped, and so
+    are the edge types without label edges (the gene edge types of a graph pruned by --prune_genes).
+    """
+    sizes = {edge_type: data[edge_type].edge_label_index.shape[1]
+             for edge_type in edge_types if edge_type[1] != "get_target" and "edge_label_index" in data[edge_type]}
+    loads = [0] * world_size
+    shards = [[] for _ in range(world_size)]
+    for edge_type in sorted(sizes, key=sizes.get, reverse=True):
+        target = loads.index(min(loads))
+        shards[target].append(edge_type)
+        loads[target] += sizes[edge_type]
+    return [edge_type for edge_type in edge_types if edge_type in shards[rank]]  # keep the model's order
+
+
+def all_reduce_gradients(net):
+    """
+    Sums the gradients of all ranks in a single all-reduce. The loss is a sum over label edges and every rank
+    draws the same dropout masks, so the summed gradient of the shards is exactly the full-batch gradient.
+    Parameters that got no gradient on any rank keep grad None, as in single-process training, so the optimizer
+    skips them.
+    """
+    params = list(net.parameters())
+    flat = torch.cat([param.grad.flatten() if param.grad is not None else param.new_zeros(param.numel())
+                      for param in params] +
+                     [torch.tensor([float(param.grad is not None) for param in params], dtype=params[0].dtype)])
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    has_grad = flat[-len(params):]
+    offset = 0
+    for param, used in zip(params, has_grad.tolist()):
+        if used > 0:
+            param.grad = flat[offset: offset + param.numel()].view_as(param).clone()
+        offset += param.numel()
+
+
+def validate_shard(net, valid_data, edge_types):
+    """
+    Per side effect validation ROC-AUC for the drug-drug relations among edge_types.
+    """
+    net.eval()
+    with torch.no_grad():
+        z_dict = net.encode(valid_data.x_dict, valid_data.edge_index_dict)
+        edge_label_index_dict, edge_label_dict = sample_edge_labels(valid_data, edge_types)
+        edge_pred = predict_edge_labels(net, z_dict, edge_label_index_dict)
+    return {relation: roc_auc_score(edge_label_dict[relation], edge_pred[relation])
+            for (_, relation, _) in edge_types if relation not in ["has_target", "get_target", "interact"]}
+
+
+def run_worker(seed, rank, world_size, args):
+    """
+    Trains one seed on this rank. Every rank holds a full replica of the model and runs the whole encoder,
+    forward and backward, with the same torch random state (hence the same dropout masks), but samples
+    negatives, decodes and backpropagates only its shard of the relations; gradients are summed across ranks
+    before every optimizer step, so the replicas stay identical. Only the decoders are parallelized: the encoder
+    is replicated, which bounds the speedup (benchmark.py --benchmark distributed measures it).
+    Validation is sharded the same way. Only rank 0 logs, checkpoints and tests.
+    Returns the test results on rank 0 and None elsewhere.
+    """
+    torch_geometric.seed_everything(seed)  # same seed everywhere: identical split and initialization
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+    my_edge_types = shard_edge_types(train_data, edge_types, rank, world_size)
+    random.seed(seed + rank)  # negatives are drawn with python's random: different on every rank
+
+    net = build_model(data, train_data, args)
+    net.eval()
+    with torch.no_grad():  # initialize the lazily sized weights before synchronizing them
+        net.encode(train_data.x_dict, train_data.edge_index_dict)
+    for param in net.parameters():
+        dist.broadcast(param.data, src=0)
+    if rank == 0:
+        print(f"Training on {world_size} ranks, {len(my_edge_types)} of {len(edge_types)} relations on rank 0")
+
+    loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+    optimizer = build_optimizer(net.parameters(), args)
+    best_val_roc = 0
+    patience_counter = 0
+    for epoch in range(args.num_epoch):
+        start = time.time()
+        loss = train_step(net, optimizer, loss_fn, train_data, my_edge_types, args.device,
+                          before_step=lambda: all_reduce_gradients(net))
+        loss = torch.tensor([loss])
+        dist.all_reduce(loss, op=dist.ReduceOp.SUM)
+
+        roc_auc_dicts = [None] * world_size
+        dist.all_gather_object(roc_auc_dicts, validate_shard(net, valid_data, my_edge_types))
+        roc_auc_dict = {relation: score for shard in roc_auc_dicts for relation, score in shard.items()}
+        roc_auc = sum(roc_auc_dict.values()) / len(roc_auc_dict)  # identical on every rank
+
+        if rank == 0:
+            print(f"| Epoch: {epoch} | Loss: {loss.item()} | Val ROC: {roc_auc} | Best ROC: {best_val_roc} "
+                  f"| Time: {time.time() - start}")
+        if best_val_roc < roc_auc:
+            best_val_roc = roc_auc
+            patience_counter = 0
+            if rank == 0:
+                torch.save(net.state_dict(), args.chkpt_dir + f"/gae_{seed}.pt")
+                print("---- Save Model ----")
+        else:
+            patience_counter += 1
+        if patience_counter >= args.patience and epoch > 50:
+            if rank == 0:
+                print(f"Early stopping due to no improvement in validation ROC-AUC score for {args.patience} epochs")
+            break
+
+    result = None
+    if rank == 0:
+        net.load_state_dict(torch.load(args.chkpt_dir + f"/gae_{seed}.pt"))
+        result = {"seed": seed, **test_model(net, test_data, edge_types)}
+        print("-" * 100)
+        print(f'| Test AUROC: {result["auroc"]} | Test AUPRC: {result["auprc"]} | Test AP@50: {result["ap50"]}')
+    dist.barrier()
+    return result
+
+
+def time_epochs_worker(local_rank, world_size, args, queue):
+    """
+    Mean wall time of a training epoch on world_size ranks of this machine, after args.warmup_epochs untimed
+    epochs, put on queue by rank 0 (benchmark.py --benchmark distributed).
+    """
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{args.master_port}", rank=local_rank,
+                            world_size=world_size)
+    try:
+        torch_geometric.seed_everything(args.seed)
+        data, train_data, valid_data, test_data = prepare_split(args)
+        my_edge_types = shard_edge_types(train_data, data.edge_types, local_rank, world_size)
+        random.seed(args.seed + local_rank)
+        net = build_model(data, train_data, args)
+        loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+        optimizer = build_optimizer(net.parameters(), args)
+        times = []
+        for epoch in range(args.warmup_epochs + args.bench_epochs):
+            dist.barrier()
+            start = time.time()
+            train_step(net, optimizer, loss_fn, train_data, my_edge_types, args.device,
+                       before_step=lambda: all_reduce_gradients(net))
+            if epoch >= args.warmup_epochs:
+                times.append(time.time() - start)
+        if local_rank == 0:
+            queue.put(sum(times) / len(times))
+    finally:
+        dist.destroy_process_group()
+
+
+# Options of main_gae.py that run_worker does not implement
+UNSUPPORTED_OPTIONS = {
+    "pretrained": None,
+    "compile": False,
+    "memory_report": False,
+    "prefetch": 0,
+    "relations_per_step": None,
+    "val_every": 1,
+    "val_subset_frac": 1.0,
+    "val_subset_edges": None,
+    "ranking_eval": False,
+    "null_replicates": 0,
+}
+
+
+def worker_main(local_rank, args):
+    rank = args.node_rank * args.nproc_per_node + local_rank
+    world_size = args.nnodes * args.nproc_per_node
+    torch.set_num_threads(args.threads_per_worker)
+    dist.init_process_group("gloo", init_method=f"tcp://{args.master_addr}:{args.master_port}",
+                            rank=rank, world_size=world_size)
+    try:
+        for seed in range(args.seed, args.seed + args.num_runs):
+            result = run_worker(seed, rank, world_size, args)
+            if rank == 0:
+                append_results(args.results_dir, result, run_config(args))
+    finally:
+        dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel training over relation shards (gloo, CPU)",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--nproc_per_node", type=int, default=2, help="worker processes on this machine")
+    parser.add_argument("--nnodes", type=int, default=1, help="number of machines")
+    parser.add_argument("--node_rank", type=int, default=0, help="index of this machine")
+    parser.add_argument("--master_addr", type=str, default="127.0.0.1", help="address of the node with rank 0")
+    parser.add_argument("--master_port", type=int, default=29500, help="free port on the node with rank 0")
+    parser.add_argument("--threads_per_worker", type=int, default=None,
+                        help="torch threads per worker process (default: cores divided by nproc_per_node)")
+    args = parser.parse_args()
+    for option, default in UNSUPPORTED_OPTIONS.items():
+        if getattr(args, option) != default:
+            parser.error(f"--{option} is not supported by distributed.py")
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, (os.cpu_count() or 1) // args.nproc_per_node)
+    mp.spawn(worker_main, args=(args,), nprocs=args.nproc_per_node)
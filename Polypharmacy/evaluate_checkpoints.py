@@ -0,0 +1,187 @@
+# evaluate_checkpoints.py
+
+import argparse
+import json
+import re
+import types
+import warnings
+
+import torch
+import torch.nn as nn
+import torch_geometric
+from torch.func import functional_call, stack_module_state, vmap
+from torch_geometric.nn.dense.linear import Linear
+
+from main_gae import build_parser
+from models.scorer import DrugPairScorer
+from train_hetero_gae import prepare_split, build_model, sample_edge_labels, score_predictions
+from train_replicas import sparse_linear_forward
+
+
+def checkpoint_seed(path):
+    """
+    Seed of the split encoded in a checkpoint name written by run_experiment (gae_{seed}.pt) or by
+    train_replicas.py (gae_{seed}_replica{k}.pt), or None.
+    """
+    match = re.search(r"gae_(\d+)(_replica\d+)?\.pt$", path)
+    return int(match.group(1)) if match else None
+
+
+def load_checkpoint(path):
+    """
+    State dict and hyperparameters of a checkpoint: a model state dict (gae_{seed}.pt, gae_{seed}_replica{k}.pt),
+    which is built with the command line hyperparameters, or a sweep trial state (trial_{id}.pt), whose best model
+    is built with the configuration of the trial.
+    """
+    checkpoint = torch.load(path)
+    if "best_model" in checkpoint:
+        return checkpoint["best_model"], checkpoint["config"]
+    return checkpoint, {}
+
+
+def stackable(modules):
+    """
+    Whether the modules have the same parameters and buffers with the same shapes, so they can be stacked.
+    """
+    shapes = [{name: value.shape for name, value in module.state_dict().items()} for module in modules]
+    return all(shape == shapes[0] for shape in shapes)
+
+
+class DrugEncoder(nn.Module):
+    """
+    HeteroGAE.encode as a module call returning the drug embeddings, for torch.func.functional_call.
+    """
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x_dict, edge_index_dict):
+        return self.net.encode(x_dict, edge_index_dict)["drug"]
+
+
+def stacked_drug_embeddings(nets, x_dict, edge_index_dict):
+    """
+    Drug embeddings of K models with identical architecture from one vmapped encoder pass, shape (K, num_drugs, dim).
+    As in train_replicas.py, the Linear layers of the first model run sparse_linear_forward, so the sparse one-hot
+    node features are not densified. The basis weights of --num_bases models are not registered parameters and
+    would be shared, so those models have to be encoded one by one.
+    """
+    encoders = [DrugEncoder(net) for net in nets]
+    params, buffers = stack_module_state(encoders)
+    for module in encoders[0].modules():
+        if isinstance(module, Linear):
+            module.forward = types.MethodType(sparse_linear_forward, module)
+
+    def encode(params, buffers):
+        return functional_call(encoders[0], (params, buffers), (x_dict, edge_index_dict))
+
+    return vmap(encode)(params, buffers)
+
+
+def stacked_drug_scores(scorers, src, dst, relation):
+    """
+    Scores the same batch of (src, dst, relation) drug pairs with K DrugPairScorers in one vmapped call.
+    Returns a (K, batch) tensor of probabilities.
+    """
+    params, buffers = stack_module_state(scorers)
+    base = scorers[0]
+
+    def score(params, buffers):
+        return functional_call(base, (params, buffers), (src, dst, relation))
+
+    return vmap(score)(params, buffers)
+
+
+def evaluate_checkpoints(paths, args):
+    """
+    Evaluates K checkpoints on the test split of args.seed, on one shared set of test positives and negatives.
+
+    The drug embeddings of each model are computed by its own encoder pass, or with args.vmap_encode by a single
+    vmapped pass over the stacked encoders (not for models of different architectures, e.g. sweep trials, or
+    --num_bases models); the K drug-pair decoders are then stacked and applied to all test pairs of all side
+    effects at once. Returns the per-model metrics, the metrics of the ensemble (mean
+    probability) and, per side effect, the spread of AUROC across models and the mean variance of the
+    predicted probabilities.
+    """
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = [edge_type for edge_type in data.edge_types
+                  if edge_type[1] not in ["interact", "has_target", "get_target"]]
+    relations = [relation for (_, relation, _) in edge_types]
+
+    nets = []
+    for path in paths:
+        state_dict, config = load_checkpoint(path)
+        net = build_model(data, train_data, argparse.Namespace(**{**vars(args), **config}))
+        net.load_state_dict(state_dict)
+        nets.append(net.eval())
+    vmap_encode = args.vmap_encode and stackable(nets) and not any(getattr(net, "num_bases", None) for net in nets)
+    if args.vmap_encode and not vmap_encode:
+        warnings.warn("--vmap_encode needs models of one architecture without --num_bases, encoding one by one")
+    with torch.no_grad():
+        if vmap_encode:
+            z_drug = stacked_drug_embeddings(nets, test_data.x_dict, test_data.edge_index_dict)
+        else:
+            z_drug = [net.encode(test_data.x_dict, test_data.edge_index_dict)["drug"] for net in nets]
+    scorers = [DrugPairScorer.from_model(net, {"drug": z}, relations) for net, z in zip(nets, z_drug)]
+
+    edge_label_index_dict, edge_label_dict = sample_edge_labels(test_data, edge_types,
+                                                                generator=torch.Generator().manual_seed(args.seed))
+    sizes = [edge_label_index_dict[edge_type].shape[1] for edge_type in edge_types]
+    edge_index = torch.cat([edge_label_index_dict[edge_type] for edge_type in edge_types], dim=1)
+    relation_index = torch.repeat_interleave(torch.arange(len(relations)), torch.tensor(sizes))
+    with torch.no_grad():
+        if stackable(scorers):
+            preds = stacked_drug_scores(scorers, edge_index[0], edge_index[1], relation_index)  # (K, num_pairs)
+        else:
+            preds = torch.stack([scorer(edge_index[0], edge_index[1], relation_index) for scorer in scorers])
+
+    def split(pred):
+        return dict(zip(relations, pred.split(sizes)))
+
+    per_model = [score_predictions(split(pred), edge_label_dict, edge_types) for pred in preds]
+    ensemble = score_predictions(split(preds.mean(dim=0)), edge_label_dict, edge_types)
+    pred_var = split(preds.var(dim=0, unbiased=False))
+    per_relation = {}
+    for relation in ensemble["roc_auc_dict"]:
+        aurocs = torch.tensor([result["roc_auc_dict"][relation] for result in per_model])
+        per_relation[relation] = {"auroc_mean": aurocs.mean().item(), "auroc_var": aurocs.var(unbiased=False).item(),
+                                  "ensemble_auroc": ensemble["roc_auc_dict"][relation],
+                                  "pred_var": pred_var[relation].mean().item()}
+    return per_model, ensemble, per_relation
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate several checkpoints on one test split in a single pass",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--checkpoints", type=str, nargs="+", required=True,
+                        help="checkpoint paths (gae_{seed}.pt, gae_{seed}_replica{k}.pt or sweep trial_{id}.pt)")
+    parser.add_argument("--output", type=str, default="./evaluation.json", help="path of the JSON report")
+    parser.add_argument("--vmap_encode", action="store_true",
+                        help="encode all models in one vmapped pass instead of one by one (not faster on few cores)")
+    args = parser.parse_args()
+
+    # Each seed of run_experiment draws its own split: a checkpoint trained on another seed has seen part of
+    # this test split during training, so its metrics (and the ensemble) are optimistic.
+    other_splits = [path for path in args.checkpoints if checkpoint_seed(path) not in (None, args.seed)]
+    if other_splits:
+        warnings.warn(f"{len(other_splits)} checkpoints were trained on another split than seed {args.seed}: "
+                      f"{other_splits}")
+
+    per_model, ensemble, per_relation = evaluate_checkpoints(args.checkpoints, args)
+    print("-" * 100)
+    for path, result in zip(args.checkpoints, per_model):
+        print(f'| {path} | Test AUROC: {result["auroc"]} | Test AUPRC: {result["auprc"]} | Test AP@50: {result["ap50"]}')
+    print(f'| ensemble | Test AUROC: {ensemble["auroc"]} | Test AUPRC: {ensemble["auprc"]} '
+          f'| Test AP@50: {ensemble["ap50"]}')
+    most_disputed = sorted(per_relation, key=lambda relation: per_relation[relation]["pred_var"], reverse=True)[:10]
+    print("Side effects with the highest prediction variance across models:")
+    for relation in most_disputed:
+        print(f"| {relation} | " + " | ".join(f"{key}: {value:.4f}" for key, value in per_relation[relation].items()))
+
+    with open(args.output, "w") as f:
+        json.dump({"seed": args.seed, "checkpoints": args.checkpoints,
+                   "per_model": [{"auroc": r["auroc"], "auprc": r["auprc"], "ap50": r["ap50"]} for r in per_model],
+                   "ensemble": {"auroc": ensemble["auroc"], "auprc": ensemble["auprc"], "ap50": ensemble["ap50"]},
+                   "per_relation": per_relation}, f, indent=1)
@@ -0,0 +1,126 @@
+# export_model.py
+
+import argparse
+import json
+
+import torch
+
+from main_gae import build_parser
+from models.scorer import DrugPairScorer, QuantizedDrugPairScorer
+
+QUANTIZE_DTYPES = {"fp16": torch.float16, "int8": torch.int8}
+
+# The training stack (torch_geometric, data loaders) is imported inside compute_drug_embeddings only,
+# so serving processes can use load_scorer with nothing but torch loaded.
+
+
+def compute_drug_embeddings(args):
+    """
+    Rebuilds the split of args.seed, loads the checkpoint and encodes the test message-passing graph
+    (training and validation edges) in eval mode.
+    Returns the model, the node embeddings and the test split.
+    """
+    import torch_geometric
+    from train_hetero_gae import prepare_split, build_model
+
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    net = build_model(data, train_data, args)
+    net.load_state_dict(torch.load(args.checkpoint))
+    net.eval()
+    with torch.no_grad():
+        z_dict = net.encode(test_data.x_dict, test_data.edge_index_dict)
+    return net, z_dict, test_data
+
+
+def export_scorer(scorer, path, metadata):
+    """
+    Exports the scorer with torch.export, with a dynamic batch dimension.
+    The metadata (side effect order and drug ids) is stored inside the archive as metadata.json.
+    """
+    batch = torch.export.Dim("batch")
+    example = (torch.zeros(2, dtype=torch.long), torch.zeros(2, dtype=torch.long), torch.zeros(2, dtype=torch.long))
+    program = torch.export.export(scorer, example, dynamic_shapes=({0: batch}, {0: batch}, {0: batch}))
+    torch.export.save(program, path, extra_files={"metadata.json": json.dumps(metadata)})
+
+
+def load_scorer(path):
+    """
+    Loads an exported scorer. Only torch is needed.
+    Returns a callable scorer(src, dst, relation) and the metadata dictionary.
+    """
+    extra_files = {"metadata.json": ""}
+    program = torch.export.load(path, extra_files=extra_files)
+    return program.module(), json.loads(extra_files["metadata.json"])
+
+
+def buffer_bytes(module):
+    return sum(buffer.numel() * buffer.element_size() for buffer in module.buffers())
+
+
+def auroc_delta_report(net, z_dict, test_data, scorer, relations, seed=0):
+    """
+    Per side effect test ROC-AUC of the full model and of scorer, on the test positives and as many negatives
+    drawn from a generator seeded with seed. Returns {relation: (full, scorer)}.
+    """
+    from metrics import roc_auc_score
+    from train_hetero_gae import sample_edge_labels
+
+    edge_types = [("drug", relation, "drug") for relation in relations]
+    edge_label_index_dict, edge_label_dict = sample_edge_labels(test_data, edge_types,
+                                                                generator=torch.Generator().manual_seed(seed))
+    report = {}
+    with torch.no_grad():
+        full = net.decode_all_relation(z_dict, edge_label_index_dict, sigmoid=True)
+        for relation_idx, (edge_type, relation) in enumerate(zip(edge_types, relations)):
+            edge_index = edge_label_index_dict[edge_type]
+            relation_index = torch.full((edge_index.shape[1],), relation_idx, dtype=torch.long)
+            compact = scorer(edge_index[0], edge_index[1], relation_index)
+            report[relation] = (roc_auc_score(edge_label_dict[relation], full[relation]),
+                                roc_auc_score(edge_label_dict[relation], compact))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export drug embeddings and decoder for serving",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--checkpoint", type=str, required=True, help="trained model checkpoint (gae_{seed}.pt)")
+    parser.add_argument("--output", type=str, default="./scorer.pt2", help="path of the exported artefact")
+    parser.add_argument("--quantize", type=str, default="none", choices=["none"] + list(QUANTIZE_DTYPES),
+                        help="store embeddings and decoder weights in int8 (per drug / per side effect scales) or fp16")
+    args = parser.parse_args()
+    from data import combo_side_effect_path
+    from utils import load_combo_side_effect
+
+    net, z_dict, test_data = compute_drug_embeddings(args)
+    relations = net.decoder_2_relation["dedicom"]
+    scorer = DrugPairScorer.from_model(net, z_dict, relations)
+    _, _, _, _, stitch_2_idx = load_combo_side_effect(combo_side_effect_path)
+    metadata = {"relations": relations, "drugs": sorted(stitch_2_idx, key=stitch_2_idx.get),
+                "quantize": args.quantize}
+    checkpoint_bytes = sum(value.numel() * value.element_size() for value in net.state_dict().values())
+    if args.quantize != "none":
+        scorer = QuantizedDrugPairScorer.from_scorer(scorer, QUANTIZE_DTYPES[args.quantize])
+    export_scorer(scorer, args.output, metadata)
+    print(f"Scorer parameters: {buffer_bytes(scorer) / 2**20:.2f} MiB "
+          f"(model state dict: {checkpoint_bytes / 2**20:.2f} MiB)")
+
+    exported, _ = load_scorer(args.output)
+    if args.quantize == "none":
+        # Parity of the exported artefact with the full model on the test positives
+        for relation_idx, relation in enumerate(relations):
+            edge_type = ("drug", relation, "drug")
+            edge_index = test_data[edge_type].edge_label_index
+            with torch.no_grad():
+                expected = net.decode_all_relation(z_dict, {edge_type: edge_index}, sigmoid=True)[relation]
+            relation_index = torch.full((edge_index.shape[1],), relation_idx, dtype=torch.long)
+            torch.testing.assert_close(exported(edge_index[0], edge_index[1], relation_index), expected)
+    else:
+        # Quantization changes the scores, so compare the ranking quality instead of the values
+        report = auroc_delta_report(net, z_dict, test_data, exported, relations, seed=args.seed)
+        deltas = torch.tensor([compact - full for full, compact in report.values()])
+        full_auroc = sum(full for full, _ in report.values()) / len(report)
+        print(f"| Test AUROC full: {full_auroc:.6f} | {args.quantize}: {full_auroc + deltas.mean().item():.6f} "
+              f"| mean delta: {deltas.mean().item():+.6f} | max |delta|: {deltas.abs().max().item():.6f}")
+    kind = "" if args.quantize == "none" else args.quantize + " "
+    print(f"Exported {kind}scorer for {len(relations)} side effects and {len(metadata['drugs'])} drugs to {args.output}")
@@ -1,57 +1,113 @@
 # main.py
 
 import argparse
-from train_hetero_gae import run_experiment
-import pickle
-parser = argparse.ArgumentParser(description="Polypharmacy Side Effect Prediction")
-parser.add_argument("--num_runs", type=int, default=20, help="number of runs with different seeds")
-parser.add_argument("--num_epoch", type=int, default=300, help="number of epochs")
-parser.add_argument("--lr", type=float, default=1e-3, help="learning rate")
-parser.add_argument("--chkpt_dir", type=str, default="./", help="checkpoint directory")
-parser.add_argument("--dropout", type=float, default=0.1, help="dropout rate")
-parser.add_argument("--device", type=str, default="cpu", help="training device")
-parser.add_argument("--pretrained", type=str, default=None, help="pretrained model checkpoint path")
-parser.add_argument("--num_bases", type=int, default=None, help="number of basis functions")
-parser.add_argument("--patience", type=int, default=20, help="patience for early stopping")
-parser.add_argument("--seed", type=int, default=1, help="random seed")
-parser.add_argument("--randomize_ppi", action="store_true", help="randomize protein interactions")
-parser.add_argument("--randomize_dpi", action="store_true", help="randomize drug protein interactions")
-args = parser.parse_args()
-results = {}
-input_seed = args.seed
-for i in range(input_seed, args.num_runs+input_seed):
-    seed = i
-    result = run_experiment(seed, args)
-    results[seed] = result
-    # print(f"Run {i + 1}: {result}")
-    print(f"Run {i + 1}: {result['auroc']:.4f}", end=None)
-    print(f"Run {i + 1}: {result['auprc']:.4f}", end=None)
-    print(f"Run {i + 1}: {result['ap50']:.4f}", end=None)
-# Save or process results as desired
-if args.num_bases is None:
-    if args.randomize_ppi:
-        if args.randomize_dpi:
-            with open("results_randomized_both.pkl", "wb") as f:
-                pickle.dump(results, f)
-        else:
-            with open("results_randomized_ppi.pkl", "wb") as f:
-                pickle.dump(results, f)
 
-    else:
-        with open("results.pkl", "wb") as f:
-            pickle.dump(results, f)
+# Only argparse is imported at module level: torch, torch_geometric and the data loaders are imported after
+# parsing, so --help and scripts reusing build_parser() start instantly.
 
+def build_parser(add_help=True):
+    parser = argparse.ArgumentParser(description="Polypharmacy Side Effect Prediction", add_help=add_help)
+    parser.add_argument("--num_runs", type=int, default=20, help="number of runs with different seeds")
+    parser.add_argument("--num_epoch", type=int, default=300, help="number of epochs")
+    parser.add_argument("--lr", type=float, default=1e-3, help="learning rate")
+    parser.add_argument("--chkpt_dir", type=str, default="./", help="checkpoint directory")
+    parser.add_argument("--dropout", type=float, default=0.1, help="dropout rate")
+    parser.add_argument("--device", type=str, default="cpu", help="training device")
+    parser.add_argument("--pretrained", type=str, default=None, help="pretrained model checkpoint path")
+    parser.add_argument("--num_bases", type=int, default=None, help="number of basis functions")
+    parser.add_argument("--hidden_dims", type=int, nargs="+", default=[64, 32], help="hidden dimensions of the encoder")
+    parser.add_argument("--encoder", type=str, default="gae", choices=["gae", "sign"],
+                        help="gae: learned message passing (HeteroGAE); sign: precomputed propagation with learned "
+                             "per-hop transforms (SIGNGAE)")
+    parser.add_argument("--sign_cache_dir", type=str, default="./sign_cache",
+                        help="directory caching the propagation operators of every split for --encoder sign")
+    parser.add_argument("--dtype", type=str, default="float64", choices=["float64", "float32"],
+                        help="precision of the model parameters and node features")
+    parser.add_argument("--lean_optimizer", action="store_true",
+                        help="Adam with reduced-precision and factored moments, allocated only for parameters "
+                             "that receive gradients")
+    parser.add_argument("--optim_state_dtype", type=str, default="bfloat16", choices=["bfloat16", "float32"],
+                        help="precision of the first moment (and unfactored second moments) of --lean_optimizer")
+    parser.add_argument("--no_factored", action="store_true",
+                        help="keep full second moments for weight matrices with --lean_optimizer")
+    parser.add_argument("--memory_report", action="store_true",
+                        help="print the parameter, gradient and optimizer memory per model component after the "
+                             "first training step")
+    parser.add_argument("--compile", action="store_true",
+                        help="run the encoder and decoders through torch.compile (checked against eager outputs)")
+    parser.add_argument("--checkpoint_activations", type=str, default="none", choices=["none", "relation"],
+                        help="recompute the encoder messages of groups of relations in the backward pass instead "
+                             "of storing them")
+    parser.add_argument("--checkpoint_group_size", type=int, default=64,
+                        help="number of relations per checkpoint with --checkpoint_activations relation")
+    parser.add_argument("--prefetch", type=int, default=0,
+                        help="number of training batches (negative samples and labels) prepared ahead in a "
+                             "background thread (0: sample in the training step)")
+    parser.add_argument("--min_se_edges", type=int, default=500,
+                        help="side effects with fewer drug pairs are left out of the graph")
+    parser.add_argument("--relations_per_step", type=int, default=None,
+                        help="train on a random subset of this many side effects per step (default: all)")
+    parser.add_argument("--relation_sampling", type=str, default="uniform", choices=["uniform", "weighted"],
+                        help="sample side effects uniformly, or with replacement proportionally to their "
+                             "number of edges")
+    parser.add_argument("--patience", type=int, default=20, help="patience for early stopping")
+    parser.add_argument("--disjoint_train_ratio", type=float, default=0.2,
+                        help="fraction of training edges used only for supervision, not for message passing")
+    parser.add_argument("--val_every", type=int, default=1, help="validate every k epochs")
+    parser.add_argument("--val_subset_frac", type=float, default=1.0,
+                        help="fraction of side effects in the fixed validation subset checked before each full "
+                             "validation (1.0: always run the full validation)")
+    parser.add_argument("--val_subset_edges", type=int, default=None,
+                        help="maximum number of positive edges per side effect in the validation subset")
+    parser.add_argument("--patience_unit", type=str, default="epoch", choices=["epoch", "eval"],
+                        help="count patience in epochs or in validation events")
+    parser.add_argument("--prune_genes", action="store_true",
+                        help="train and evaluate only the drug-drug side effects, on the genes within reach of the "
+                             "drug embeddings (the targets and the genes len(hidden_dims) - 1 PPI hops from them)")
+    parser.add_argument("--ranking_eval", action="store_true",
+                        help="also rank every test pair against all partner drugs (filtered MRR and Hits@1/3/10)")
+    parser.add_argument("--ranking_block_size", type=int, default=4096,
+                        help="test pairs scored per decoder call in the ranking evaluation")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--randomize_ppi", action="store_true", help="randomize protein interactions")
+    parser.add_argument("--randomize_dpi", action="store_true", help="randomize drug protein interactions")
+    parser.add_argument("--null_replicates", type=int, default=0,
+                        help="with --randomize_ppi/--randomize_dpi: train every seed on this many randomized "
+                             "graphs, drawn at once from a single load of the data (0: one randomization per seed)")
+    parser.add_argument("--null_seed", type=int, default=0, help="random seed of the null-model replicates")
+    parser.add_argument("--results_dir", type=str, default="./results", help="directory of the columnar results store")
+    return parser
 
-else:
-    if args.randomize_ppi:
-        if args.randomize_dpi:
-            with open("results_randomized_both_shared.pkl", "wb") as f:
-                pickle.dump(results, f)
-        else:
-            with open("results_randomized_ppi_shared.pkl", "wb") as f:
-                pickle.dump(results, f)
-    else:
 
-        with open("results_shared_basis.pkl", "wb") as f:
-            pickle.dump(results, f)
+if __name__ == "__main__":
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.null_replicates and not (args.randomize_ppi or args.randomize_dpi):
+        parser.error("--null_replicates needs --randomize_ppi and/or --randomize_dpi")
+    if args.encoder == "sign" and (args.num_bases is not None or args.relations_per_step):
+        parser.error("--encoder sign does not support --num_bases or --relations_per_step")
+    from train_hetero_gae import run_experiment
+    from results_store import append_results, run_config
 
+    null_graphs = None
+    if args.null_replicates:
+        from data import load_data
+        from null_models import NullGraphReplicates
+        null_graphs = NullGraphReplicates(load_data(min_side_effect_edges=args.min_se_edges), args.null_replicates,
+                                          args.randomize_ppi, args.randomize_dpi, seed=args.null_seed)
+
+    input_seed = args.seed
+    for i in range(input_seed, args.num_runs+input_seed):
+        seed = i
+        for replicate in range(len(null_graphs)) if null_graphs is not None else [None]:
+            if replicate is None:
+                result = run_experiment(seed, args)
+            else:
+                print(f"Null-model replicate {replicate}")
+                result = {**run_experiment(seed, args, null_graphs[replicate]), "null_replicate": replicate}
+            # Results are appended to the store after every run, so an interrupted sweep keeps its finished runs
+            append_results(args.results_dir, result, run_config(args))
+        # print(f"Run {i + 1}: {result}")
+        print(f"Run {i + 1}: {result['auroc']:.4f}", end=None)
+        print(f"Run {i + 1}: {result['auprc']:.4f}", end=None)
+        print(f"Run {i + 1}: {result['ap50']:.4f}", end=None)
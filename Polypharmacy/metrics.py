@@ -1,6 +1,22 @@
 import torch
 from operator import itemgetter
-from sklearn.metrics import roc_auc_score, accuracy_score, average_precision_score
+
+
+# sklearn.metrics takes about a second to import, so it is only loaded when a score is computed
+
+def roc_auc_score(*args, **kwargs):
+    from sklearn.metrics import roc_auc_score
+    return roc_auc_score(*args, **kwargs)
+
+
+def accuracy_score(*args, **kwargs):
+    from sklearn.metrics import accuracy_score
+    return accuracy_score(*args, **kwargs)
+
+
+def average_precision_score(*args, **kwargs):
+    from sklearn.metrics import average_precision_score
+    return average_precision_score(*args, **kwargs)
 
 
 def concat_all(item_dict):
@@ -30,6 +46,8 @@ def cal_roc_auc_score_per_side_effect(preds, labels, edge_types):
     counts_dict = {}
     for src, relation, dst in edge_types:
         if relation not in ["has_target", "get_target", "interact"]:
+            if len(labels[relation]) == 0:  # side effect without edges in this split
+                continue
             score = roc_auc_score(labels[relation], preds[relation])
             total_roc_auc[relation] = score
             counts_dict[relation] = len(labels[relation])
@@ -41,6 +59,8 @@ def cal_average_precision_score_per_side_effect(preds, labels, edge_types):
     counts_dict = {}
     for src, relation, dst in edge_types:
         if relation not in ["has_target", "get_target", "interact"]:
+            if len(labels[relation]) == 0:  # side effect without edges in this split
+                continue
             score = average_precision_score(labels[relation], preds[relation])
             total_prec[relation] = score
             counts_dict[relation] = len(labels[relation])
@@ -69,7 +89,7 @@ def cal_apk(preds, labels, edge_types, k=50):
     total_apk = {}
 
     for src, relation, dst in edge_types:
-        if relation in ["has_target", "get_target", "interact"]:
+        if relation in ["has_target", "get_target", "interact"] or len(labels[relation]) == 0:
             continue
 
         actual = []
@@ -84,3 +104,17 @@ def cal_apk(preds, labels, edge_types, k=50):
         total_apk[relation] = apk(actual, predicted, k=k)
 
     return sum(total_apk.values()) / len(total_apk), total_apk
+
+
+def cal_filtered_ranking_metrics(ranks, ks=(1, 3, 10)):
+    """
+    MRR and Hits@k per side effect from filtered ranks (HeteroGAE.filtered_ranks), averaged over side effects.
+    Returns {"mrr": ..., "mrr_dict": {...}, "hits1": ..., "hits1_dict": {...}, ...}.
+    """
+    ranks = {relation: rank.double() for relation, rank in ranks.items() if len(rank) > 0}
+    metrics = {"mrr_dict": {relation: (1 / rank).mean().item() for relation, rank in ranks.items()}}
+    for k in ks:
+        metrics[f"hits{k}_dict"] = {relation: (rank <= k).double().mean().item() for relation, rank in ranks.items()}
+    for name in list(metrics):
+        metrics[name[:-len("_dict")]] = sum(metrics[name].values()) / len(metrics[name])
+    return metrics
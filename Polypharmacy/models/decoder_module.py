@@ -38,6 +38,26 @@ class BilinearDecoder(nn.Module):
         out = torch.matmul(src, self.M[relation])
         return (out * dst).sum(dim = 1)
 
+    def score_all(self, src, dst, relations):
+        """
+        Scores every (src row, dst row) pair under each relation in one batched contraction.
+        Returns a tensor of shape (len(src), len(relations), len(dst)).
+        """
+        M = torch.stack([self.M[relation] for relation in relations])  # (R, dim, dim)
+        out = torch.einsum("bd,rde->bre", src, M)
+        return torch.einsum("bre,ne->brn", out, dst)
+
+    def score_queries(self, src, dst, relations, relation_index):
+        """
+        Scores each src row against every dst row under its own relation, relations[relation_index[i]] for row i.
+        Returns a tensor of shape (len(src), len(dst)).
+        """
+        out = torch.empty_like(src)
+        for idx in relation_index.unique().tolist():  # one matrix product per relation present in the batch
+            rows = relation_index == idx
+            out[rows] = torch.matmul(src[rows], self.M[relations[idx]])
+        return torch.matmul(out, dst.t())
+
     def init_weights(self):
         for relation in self.M.keys():
             self.M[relation] = nn.init.xavier_uniform_(self.M[relation])
@@ -68,6 +88,26 @@ class DEDICOM(nn.Module):
         out = (out * dst).sum(dim = 1)
         return out
 
+    def score_all(self, src, dst, relations):
+        """
+        Scores every (src row, dst row) pair under each relation in one batched contraction,
+        (src * D_r) R (dst * D_r)^T for all relations r at once.
+        Returns a tensor of shape (len(src), len(relations), len(dst)).
+        """
+        D = torch.stack([self.D[relation].squeeze(-1) for relation in relations])  # (R, dim)
+        out = src.unsqueeze(1) * D.unsqueeze(0)  # (B, R, dim)
+        out = torch.matmul(out, self.R) * D.unsqueeze(0)
+        return torch.einsum("brd,nd->brn", out, dst)
+
+    def score_queries(self, src, dst, relations, relation_index):
+        """
+        Scores each src row against every dst row under its own relation, relations[relation_index[i]] for row i,
+        as one matrix product for the whole batch. Returns a tensor of shape (len(src), len(dst)).
+        """
+        D = torch.stack([self.D[relation].squeeze(-1) for relation in relations])[relation_index]  # (B, dim)
+        out = torch.matmul(src * D, self.R) * D
+        return torch.matmul(out, dst.t())
+
     def init_weights(self):
         self.R = nn.init.xavier_uniform_(self.R)
 
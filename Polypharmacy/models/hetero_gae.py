@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn import Linear
+from torch.utils.checkpoint import checkpoint
 from torch_geometric.nn import GeneralConv
 from typing import Union
 from torch import Tensor
@@ -124,7 +125,8 @@ GeneralConv.reset_parameters = reset_params
 
 class HeteroGAE(nn.Module):
     def __init__(self, hidden_dims, out_dim, node_types, edge_types,
-                 decoder_2_relation, relation_2_decoder, num_bases=None, input_dim=None, dropout=0.5, device="cpu"):
+                 decoder_2_relation, relation_2_decoder, num_bases=None, input_dim=None, dropout=0.5, device="cpu",
+                 checkpoint_activations=None, checkpoint_group_size=64):
         super().__init__()
 
         self.hidden_dims = hidden_dims
@@ -198,6 +200,10 @@ class HeteroGAE(nn.Module):
             else:
                 raise NotImplemented
         self.dropout = dropout
+        # Activation checkpointing: None or "relation" (recompute the messages of groups of checkpoint_group_size
+        # edge types during backward)
+        self.checkpoint_activations = checkpoint_activations
+        self.checkpoint_group_size = checkpoint_group_size
 
     def forward(self):
         pass
@@ -229,24 +235,60 @@ class HeteroGAE(nn.Module):
             conv_dicts.append(D)
         return conv_dicts
 
-    def encode(self, x_dict, edge_index_dict):
+    def encode(self, x_dict, edge_index_dict, edge_type_weight=None):
         """
         The encode method takes an input dictionary x_dict (node features)
         and an edge_index_dict (edge indices) and applies the encoder layers
         to generate the latent node representations (z_dict).
         Dropout and ReLU activation are applied after each layer except the last one
         where only dropout is applied.
+        Only the convolutions of the edge types present in edge_index_dict are run. edge_type_weight
+        optionally scales the messages of individual edge types before they are summed per node type.
         """
 
         z_dict = x_dict
         for idx, conv in enumerate(self.encoder):
-            z_dict = conv(z_dict, edge_index_dict)
+            if self.checkpoint_activations == "relation" and torch.is_grad_enabled():
+                z_dict = self.checkpointed_hetero_conv(conv, z_dict, edge_index_dict, edge_type_weight)
+            elif edge_type_weight is None:
+                z_dict = conv(z_dict, edge_index_dict)
+            else:
+                z_dict = self.weighted_hetero_conv(conv, z_dict, edge_index_dict, edge_type_weight)
             if idx < len(self.encoder) - 1:
                 z_dict = {key: x.relu() for key, x in z_dict.items()}
             z_dict = {key: F.dropout(x, p=self.dropout, training=self.training)
                       for key, x in z_dict.items()}
         return z_dict
 
+    def checkpointed_hetero_conv(self, conv, x_dict, edge_index_dict, edge_type_weight=None):
+        """
+        HeteroConv over groups of checkpoint_group_size edge types, each group under its own checkpoint, so
+        only the summed outputs are kept for backward and at most one group of messages is alive at a time.
+        """
+        edge_index_items = list(edge_index_dict.items())
+        out_dict = {}
+        for start in range(0, len(edge_index_items), self.checkpoint_group_size):
+            group = dict(edge_index_items[start: start + self.checkpoint_group_size])
+            group_out = checkpoint(self.weighted_hetero_conv, conv, x_dict, group, edge_type_weight or {},
+                                   use_reentrant=False)
+            for dst, out in group_out.items():
+                out_dict[dst] = out if dst not in out_dict else out_dict[dst] + out
+        return out_dict
+
+    @staticmethod
+    def weighted_hetero_conv(conv, x_dict, edge_index_dict, edge_type_weight):
+        """
+        Same as HeteroConv with sum aggregation, but the output of every edge type is multiplied by its
+        weight in edge_type_weight (default 1) before the sum.
+        """
+        out_dict = {}
+        for edge_type, edge_index in edge_index_dict.items():
+            src, _, dst = edge_type
+            out = conv.convs[edge_type]((x_dict[src], x_dict[dst]), edge_index)
+            out = out * edge_type_weight.get(edge_type, 1.)
+            out_dict[dst] = out if dst not in out_dict else out_dict[dst] + out
+        return out_dict
+
     def decode_all_relation(self, z_dict, edge_index_dict, sigmoid=False):
         output = {}  # stores the edge predictions for each relation
         for edge_type in self.edge_types:  # iterate over all edge types
@@ -260,3 +302,93 @@ class HeteroGAE(nn.Module):
             if sigmoid:
                 output[relation] = F.sigmoid(output[relation])
         return output
+
+    @torch.no_grad()
+    def query_top_k(self, z_dict, query_idx, k=10, relations=None, chunk_size=64, exclude_self=True):
+        """
+        Finds, for each query drug, the k (partner drug, side effect) pairs with the highest predicted probability.
+
+        The query drugs are scored against all drugs under a chunk of side effects at a time with the batched
+        decoder contraction, and only a running top-k per query is kept, so the full
+        (queries x side effects x drugs) score tensor is never materialised.
+        relations defaults to all side effects handled by the DEDICOM decoder.
+        Returns probabilities, partner drug indices and indices into relations, each of shape (len(query_idx), k).
+        """
+        if relations is None:
+            relations = self.decoder_2_relation["dedicom"]
+        decoder = self.decoder[self.relation_2_decoder[relations[0]]]
+        query_idx = torch.as_tensor(query_idx, dtype=torch.long, device=z_dict["drug"].device)
+        src = z_dict["drug"][query_idx]
+        dst = z_dict["drug"]
+        num_drugs = dst.shape[0]
+        rows = torch.arange(len(query_idx), device=src.device)
+
+        top_scores, top_idx = None, None
+        for start in range(0, len(relations), chunk_size):
+            scores = decoder.score_all(src, dst, relations[start: start + chunk_size])  # (B, chunk, num_drugs)
+            if exclude_self:
+                scores[rows, :, query_idx] = float("-inf")
+            scores, idx = torch.topk(scores.flatten(1), min(k, scores[0].numel()), dim=1)
+            idx = idx + start * num_drugs  # flat index over (relation, partner drug)
+            if top_scores is not None:  # merge with the best pairs of the previous chunks
+                scores = torch.cat([top_scores, scores], dim=1)
+                scores, order = torch.topk(scores, min(k, scores.shape[1]), dim=1)
+                idx = torch.gather(torch.cat([top_idx, idx], dim=1), 1, order)
+            top_scores, top_idx = scores, idx
+        return F.sigmoid(top_scores), top_idx % num_drugs, top_idx // num_drugs
+
+    @torch.no_grad()
+    def filtered_ranks(self, z_dict, query_edge_index_dict, known_edge_index_dict, block_size=4096):
+        """
+        Filtered rank of every query edge (u, v) of a relation among all candidate partners of u.
+
+        Candidates that are known positives of the relation for u (known_edge_index_dict, the query edges
+        themselves included) are filtered out, except v itself, and so is u for relations within one node type.
+        The queries of all relations handled by a decoder are scored in blocks of block_size, each block with a
+        single decoder call against all candidates; the known positives are kept as a CSR index over
+        (relation, u) rows, so no dense (relation x nodes x nodes) mask is built.
+        Ties with the target count half. Returns {relation: ranks}, ranks starting at 1.
+        """
+        ranks = {}
+        for decoder_type, decoder_relations in self.decoder_2_relation.items():
+            edge_types = [edge_type for edge_type in query_edge_index_dict if edge_type[1] in decoder_relations]
+            if not edge_types:
+                continue
+            src_type, _, dst_type = edge_types[0]
+            z_src, z_dst = z_dict[src_type], z_dict[dst_type]
+            num_src, num_dst = z_src.shape[0], z_dst.shape[0]
+            relations = [relation for _, relation, _ in edge_types]
+            device = z_src.device
+
+            # (relation, u) rows of the queries and the CSR index of the known positives
+            queries = torch.cat([torch.cat([torch.full((1, query_edge_index_dict[edge_type].shape[1]), idx,
+                                                       device=device), query_edge_index_dict[edge_type]])
+                                 for idx, edge_type in enumerate(edge_types)], dim=1)  # (3, num_queries)
+            known = torch.cat([torch.cat([torch.full((1, known_edge_index_dict[edge_type].shape[1]), idx,
+                                                     device=device), known_edge_index_dict[edge_type]])
+                               for idx, edge_type in enumerate(edge_types)], dim=1)
+            known_rows = known[0] * num_src + known[1]
+            keys = torch.unique(known_rows * num_dst + known[2])  # sorted by row
+            known_cols = keys % num_dst
+            rowptr = torch.searchsorted(keys // num_dst, torch.arange(len(relations) * num_src + 1, device=device))
+
+            query_ranks = []
+            for start in range(0, queries.shape[1], block_size):
+                relation_index, u, v = queries[:, start: start + block_size]
+                rows = torch.arange(len(u), device=device)
+                scores = self.decoder[decoder_type].score_queries(z_src[u], z_dst, relations, relation_index)
+                target = scores[rows, v].clone()
+                query_rows = relation_index * num_src + u
+                row_start, row_count = rowptr[query_rows], rowptr[query_rows + 1] - rowptr[query_rows]
+                mask_rows = torch.repeat_interleave(rows, row_count)
+                offsets = torch.arange(len(mask_rows), device=device) - torch.repeat_interleave(
+                    torch.cumsum(row_count, 0) - row_count, row_count)
+                scores[mask_rows, known_cols[torch.repeat_interleave(row_start, row_count) + offsets]] = float("-inf")
+                scores[rows, v] = float("-inf")  # the target is compared, not counted
+                if src_type == dst_type:
+                    scores[rows, u] = float("-inf")
+                target = target.unsqueeze(1)
+                query_ranks.append(1 + (scores > target).sum(dim=1) + 0.5 * (scores == target).sum(dim=1))
+            sizes = [query_edge_index_dict[edge_type].shape[1] for edge_type in edge_types]
+            ranks.update(zip(relations, torch.cat(query_ranks).split(sizes)))
+        return ranks
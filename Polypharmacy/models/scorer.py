@@ -0,0 +1,88 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class DrugPairScorer(nn.Module):
+    """
+    Self-contained DEDICOM scorer over precomputed drug embeddings.
+
+    Side effects are addressed by their position in a fixed relation order. The module only depends on
+    torch, so it can be exported with torch.export and loaded by an inference process that has neither
+    the model source nor torch_geometric.
+    """
+
+    def __init__(self, z, D, R):
+        super().__init__()
+        self.register_buffer("z", z)  # (num_drugs, dim) final drug embeddings
+        self.register_buffer("D", D)  # (num_relations, dim) diagonal of D_r for every side effect
+        self.register_buffer("R", R)  # (dim, dim) global interaction matrix
+
+    @classmethod
+    def from_model(cls, net, z_dict, relations=None):
+        """
+        Builds the scorer from a HeteroGAE and its drug embeddings.
+        relations fixes the side effect order (default: the order of the DEDICOM decoder).
+        """
+        if relations is None:
+            relations = net.decoder_2_relation["dedicom"]
+        decoder = net.decoder["dedicom"]
+        D = torch.stack([decoder.D[relation].detach().squeeze(-1) for relation in relations])
+        return cls(z_dict["drug"].detach().clone(), D, decoder.R.detach().clone())
+
+    def forward(self, src, dst, relation):
+        """
+        Probability of side effect relation[i] for the drug pair (src[i], dst[i]).
+        """
+        d = self.D[relation]
+        out = torch.matmul(self.z[src] * d, self.R) * d
+        return F.sigmoid((out * self.z[dst]).sum(dim=-1))
+
+
+def quantize_symmetric(x, dtype):
+    """
+    Quantizes a 2d tensor row by row: int8 with one float32 scale per row (max |x| / 127), or float16
+    without scales. Returns the quantized tensor and the scales (None for float16).
+    """
+    if dtype == torch.float16:
+        return x.to(torch.float16), None
+    scale = x.abs().amax(dim=-1).float().clamp_min(1e-12) / 127.
+    q = torch.round(x.float() / scale.unsqueeze(-1)).clamp(-127, 127).to(torch.int8)
+    return q, scale
+
+
+class QuantizedDrugPairScorer(nn.Module):
+    """
+    DrugPairScorer with int8 or float16 storage.
+
+    With int8, the drug embeddings carry one scale per drug, D one scale per side effect and R one scale per row.
+    Only the rows gathered for a batch are dequantized (to float32), so the full-precision tables are never
+    materialised.
+    """
+
+    def __init__(self, z, D, R, dtype=torch.int8):
+        super().__init__()
+        for name, x in [("z", z), ("D", D), ("R", R)]:
+            q, scale = quantize_symmetric(x, dtype)
+            self.register_buffer(name, q)
+            self.register_buffer(name + "_scale", scale)
+
+    @classmethod
+    def from_scorer(cls, scorer, dtype=torch.int8):
+        return cls(scorer.z, scorer.D, scorer.R, dtype)
+
+    @staticmethod
+    def dequantize(q, scale):
+        return q.float() if scale is None else q.float() * scale.unsqueeze(-1)
+
+    def forward(self, src, dst, relation):
+        """
+        Probability of side effect relation[i] for the drug pair (src[i], dst[i]).
+        """
+        z_scale = self.z_scale
+        D_scale = self.D_scale
+        z_src = self.dequantize(self.z[src], None if z_scale is None else z_scale[src])
+        z_dst = self.dequantize(self.z[dst], None if z_scale is None else z_scale[dst])
+        d = self.dequantize(self.D[relation], None if D_scale is None else D_scale[relation])
+        out = torch.matmul(z_src * d, self.dequantize(self.R, self.R_scale)) * d
+        return F.sigmoid((out * z_dst).sum(dim=-1))
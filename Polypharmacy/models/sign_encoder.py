@@ -0,0 +1,148 @@
+import hashlib
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch_geometric.utils as pyg_utils
+from torch_geometric.nn.dense.linear import Linear
+
+from models.decoder_module import BilinearDecoder, DEDICOM
+from models.hetero_gae import HeteroGAE
+
+PPI_EDGE_TYPE = ("gene", "interact", "gene")
+DPI_EDGE_TYPE = ("drug", "has_target", "gene")
+REV_DPI_EDGE_TYPE = ("gene", "get_target", "drug")
+
+# Propagated features of every node type, in the order of the per-hop transforms. The node features are one-hot,
+# so each hop is a row-normalized (mean) propagation operator of the message-passing graph of a split.
+HOPS = {
+    "drug": ["self", "drug-drug", "targets", "targets-ppi"],
+    "gene": ["self", "ppi", "drugs"],
+}
+
+
+def mean_adjacency(edge_index, num_src, num_dst, dtype):
+    """
+    Sparse (num_src, num_dst) operator averaging over the dst neighbours of every src node.
+    """
+    edge_index = pyg_utils.coalesce(edge_index)
+    degree = pyg_utils.degree(edge_index[0], num_src, dtype=dtype)
+    values = 1 / degree[edge_index[0]]
+    return torch.sparse_coo_tensor(edge_index, values, (num_src, num_dst)).coalesce()
+
+
+class SIGNGAE(nn.Module):
+    """
+    SIGN-style alternative to HeteroGAE: the propagation over the message-passing graph is not learned but
+    precomputed, and the encoder only learns one linear transform per hop followed by a linear output layer,
+    z = W_out [relu(P_0 X W_0) || ... || relu(P_k X W_k)] per node type.
+
+    Drugs see themselves, the mean of their side effect partners (all side effects together), of their targets and
+    of the PPI neighbours of their targets; genes see themselves, their PPI neighbours and the drugs targeting them.
+    The operators only depend on the graph of a split, so they are computed the first time that graph is encoded,
+    kept in memory and, with cache_dir, saved to disk under a fingerprint of the graph.
+    The decoders are those of HeteroGAE.
+    """
+
+    # The decoders and everything built on them are shared with HeteroGAE
+    decode_all_relation = HeteroGAE.decode_all_relation
+    query_top_k = HeteroGAE.query_top_k
+    filtered_ranks = HeteroGAE.filtered_ranks
+
+    def __init__(self, hidden_dims, out_dim, node_types, edge_types, decoder_2_relation, relation_2_decoder,
+                 dropout=0.5, device="cpu", cache_dir=None):
+        super().__init__()
+        self.hidden_dims = hidden_dims
+        self.out_dim = out_dim
+        self.edge_types = edge_types
+        self.node_types = node_types
+        self.decoder_2_relation = decoder_2_relation
+        self.relation_2_decoder = relation_2_decoder
+        self.dropout = dropout
+        self.cache_dir = cache_dir
+        self.operator_cache = {}  # edge tensors of a graph -> (the tensors, its propagation operators)
+
+        self.hop_transforms = nn.ModuleDict({node_type: nn.ModuleList([Linear(-1, hidden_dims[0]) for _ in hops])
+                                             for node_type, hops in HOPS.items()})
+        self.out = nn.ModuleDict({node_type: Linear(-1, out_dim) for node_type in HOPS})
+
+        self.decoder = nn.ModuleDict()
+        for decoder_type in self.decoder_2_relation.keys():
+            if decoder_type == "bilinear":
+                self.decoder[decoder_type] = BilinearDecoder(out_dim, self.decoder_2_relation["bilinear"], device)
+            elif decoder_type == "dedicom":
+                self.decoder[decoder_type] = DEDICOM(out_dim, self.decoder_2_relation["dedicom"], device)
+            else:
+                raise NotImplemented
+
+    def forward(self):
+        pass
+
+    def encode(self, x_dict, edge_index_dict, edge_type_weight=None):
+        """
+        Same interface as HeteroGAE.encode. edge_type_weight is not supported: the side effect graphs enter
+        the encoder only through the precomputed drug-drug operator.
+        """
+        if edge_type_weight is not None:
+            raise ValueError("SIGNGAE precomputes the propagation and cannot weight edge types")
+        operators = self.propagation_operators(x_dict, edge_index_dict)
+        z_dict = {}
+        for node_type, transforms in self.hop_transforms.items():
+            # the operators of a split are fixed, so the hop inputs P X reduce to P (X is the identity)
+            h = torch.cat([lin(operator) for lin, operator in zip(transforms, operators[node_type])], dim=-1)
+            h = F.dropout(h.relu(), p=self.dropout, training=self.training)
+            z_dict[node_type] = F.dropout(self.out[node_type](h), p=self.dropout, training=self.training)
+        return z_dict
+
+    def propagation_operators(self, x_dict, edge_index_dict):
+        """
+        The operators of HOPS for the graph given by edge_index_dict, from memory, from cache_dir or computed.
+        """
+        edge_types = [edge_type for edge_type in sorted(edge_index_dict) if edge_type != REV_DPI_EDGE_TYPE]
+        # Holding the edge tensors in the cache keeps their storage alive, so a matching data_ptr is the same graph
+        key = tuple((edge_type, edge_index_dict[edge_type].data_ptr(), edge_index_dict[edge_type].shape[1])
+                    for edge_type in edge_types)
+        if key not in self.operator_cache:
+            path = None
+            if self.cache_dir is not None:
+                fingerprint = hashlib.sha1(str([(edge_type, x_dict[edge_type[0]].shape[0], str(x_dict["drug"].dtype))
+                                                for edge_type in edge_types]).encode())
+                for edge_type in edge_types:
+                    fingerprint.update(edge_index_dict[edge_type].cpu().numpy().tobytes())
+                path = os.path.join(self.cache_dir, f"sign_{fingerprint.hexdigest()[:16]}.pt")
+            if path is not None and os.path.exists(path):
+                operators = torch.load(path)
+            else:
+                operators = self.compute_propagation_operators(x_dict, edge_index_dict)
+                if path is not None:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    torch.save(operators, path)
+            device = x_dict["drug"].device
+            operators = {node_type: [operator.to(device) for operator in ops] for node_type, ops in operators.items()}
+            self.operator_cache[key] = ([edge_index_dict[edge_type] for edge_type in edge_types], operators)
+        return self.operator_cache[key][1]
+
+    @staticmethod
+    def compute_propagation_operators(x_dict, edge_index_dict):
+        dtype = x_dict["drug"].dtype
+        num_drugs, num_genes = x_dict["drug"].shape[0], x_dict["gene"].shape[0]
+        ppi = edge_index_dict[PPI_EDGE_TYPE].cpu()
+        dpi = edge_index_dict[DPI_EDGE_TYPE].cpu()
+        # drug pairs are unordered, and the PPI is undirected
+        ddi = torch.cat([edge_index.cpu() for (src, _, dst), edge_index in edge_index_dict.items()
+                         if src == dst == "drug"], dim=1)
+        ddi = torch.cat([ddi, ddi.flip(0)], dim=1)
+        ppi = torch.cat([ppi, ppi.flip(0)], dim=1)
+
+        ppi_mean = mean_adjacency(ppi, num_genes, num_genes, dtype)
+        drug_targets = mean_adjacency(dpi, num_drugs, num_genes, dtype)
+        return {
+            "drug": [x_dict["drug"].cpu().coalesce(),
+                     mean_adjacency(ddi, num_drugs, num_drugs, dtype),
+                     drug_targets,
+                     torch.sparse.mm(drug_targets, ppi_mean).coalesce()],
+            "gene": [x_dict["gene"].cpu().coalesce(),
+                     ppi_mean,
+                     mean_adjacency(dpi.flip(0), num_genes, num_drugs, dtype)],
+        }
@@ -0,0 +1,60 @@
+import copy
+
+import torch
+import torch_geometric.utils as pyg_utils
+
+PPI_EDGE_TYPE = ("gene", "interact", "gene")
+DPI_EDGE_TYPE = ("drug", "has_target", "gene")
+REV_DPI_EDGE_TYPE = ("gene", "get_target", "drug")
+
+
+class NullGraphReplicates:
+    """
+    K randomized versions of the protein-protein and/or drug-protein interactions of a graph built by
+    load_data, as used for the null-model ablations.
+
+    Like randomize_dataframe_col2_values, a replicate keeps the first endpoint of every interaction and
+    permutes the second one (gene 2 of a PPI edge, the target gene of a DPI edge), so gene and drug degrees
+    on the permuted side are preserved. All permutations are drawn in one vectorized pass from a single
+    seeded generator and stored as int32 index arrays over the shared base graph; a replicate is only
+    materialised as a HeteroData when it is requested.
+    Unlike the dataframe version, the permutation is applied to the deduplicated edges of the graph, so
+    interactions that load_data drops (unknown genes, duplicated rows) never enter the shuffle.
+    """
+
+    def __init__(self, data, num_replicates, randomize_ppi=False, randomize_dpi=False, seed=0):
+        self.data = data
+        self.num_replicates = num_replicates
+        generator = torch.Generator().manual_seed(seed)
+        self.permutations = {}  # edge type -> (num_replicates, num_edges) permutations of the second endpoint
+        for edge_type, randomize in [(PPI_EDGE_TYPE, randomize_ppi), (DPI_EDGE_TYPE, randomize_dpi)]:
+            if randomize:
+                num_edges = data[edge_type].edge_index.shape[1]
+                keys = torch.rand(num_replicates, num_edges, generator=generator)
+                self.permutations[edge_type] = keys.argsort(dim=1).to(torch.int32)
+
+    def __len__(self):
+        return self.num_replicates
+
+    def permuted_edge_index(self, edge_type, replicate):
+        """
+        Edge index of edge_type in the given replicate, sorted and without duplicate edges.
+        """
+        src, dst = self.data[edge_type].edge_index
+        edge_index = torch.stack([src, dst[self.permutations[edge_type][replicate].long()]])
+        return pyg_utils.coalesce(edge_index)
+
+    def __getitem__(self, replicate):
+        """
+        Materialises a replicate. The returned graph shares every tensor it does not randomize with the base graph.
+        """
+        if not 0 <= replicate < self.num_replicates:
+            raise IndexError(f"replicate {replicate} out of range for {self.num_replicates} replicates")
+        data = copy.copy(self.data)
+        if PPI_EDGE_TYPE in self.permutations:
+            data[PPI_EDGE_TYPE].edge_index = self.permuted_edge_index(PPI_EDGE_TYPE, replicate)
+        if DPI_EDGE_TYPE in self.permutations:
+            edge_index = self.permuted_edge_index(DPI_EDGE_TYPE, replicate)
+            data[DPI_EDGE_TYPE].edge_index = edge_index
+            data[REV_DPI_EDGE_TYPE].edge_index = pyg_utils.sort_edge_index(edge_index.flip(0))
+        return data
@@ -0,0 +1,130 @@
+from collections import defaultdict
+
+import torch
+
+STATE_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+
+class LeanAdam(torch.optim.Optimizer):
+    """
+    Adam with compact optimizer state, for models with many per-relation weight matrices.
+
+    - The first moment is stored in state_dtype (e.g. bfloat16) instead of the parameter precision.
+    - With factored=True, the second moment of a matrix is kept as one row and one column average
+      (as in Adafactor) instead of a full matrix, which brings it from m * n down to m + n values.
+      Vectors and scalars keep a full second moment in state_dtype.
+    - Parameters without a gradient in a step (e.g. relations not sampled with --relations_per_step) are
+      skipped entirely: no state is allocated for them until they get a gradient, their step count does not
+      advance, and they are not decayed.
+    The update itself is computed in float32 and applied in the parameter precision.
+    """
+
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, state_dtype=torch.bfloat16, factored=True):
+        defaults = dict(lr=lr, betas=betas, eps=eps, state_dtype=state_dtype, factored=factored)
+        super().__init__(params, defaults)
+
+    def load_state_dict(self, state_dict):
+        """
+        Optimizer.load_state_dict casts every floating point state to the precision of its parameter, so the
+        moments are cast back to the precision they are kept in.
+        """
+        super().load_state_dict(state_dict)
+        for group in self.param_groups:
+            for param in group["params"]:
+                state = self.state.get(param, {})
+                for key in ["exp_avg", "exp_avg_sq"]:
+                    if key in state:
+                        state[key] = state[key].to(group["state_dtype"])
+                for key in ["exp_avg_sq_row", "exp_avg_sq_col"]:
+                    if key in state:
+                        state[key] = state[key].float()
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group["betas"]
+            for param in group["params"]:
+                if param.grad is None:
+                    continue
+                grad = param.grad.float()
+                state = self.state[param]
+                if not state:
+                    state["step"] = 0
+                    state["exp_avg"] = torch.zeros_like(param, dtype=group["state_dtype"])
+                    if group["factored"] and param.dim() == 2 and min(param.shape) > 1:
+                        state["exp_avg_sq_row"] = torch.zeros(param.shape[0], dtype=torch.float32,
+                                                              device=param.device)
+                        state["exp_avg_sq_col"] = torch.zeros(param.shape[1], dtype=torch.float32,
+                                                              device=param.device)
+                    else:
+                        state["exp_avg_sq"] = torch.zeros_like(param, dtype=group["state_dtype"])
+                state["step"] += 1
+
+                exp_avg = state["exp_avg"].float().mul_(beta1).add_(grad, alpha=1 - beta1)
+                state["exp_avg"].copy_(exp_avg)
+                if "exp_avg_sq" in state:
+                    exp_avg_sq = state["exp_avg_sq"].float().mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                    state["exp_avg_sq"].copy_(exp_avg_sq)
+                else:
+                    grad_sq = grad * grad
+                    row = state["exp_avg_sq_row"].mul_(beta2).add_(grad_sq.mean(dim=1), alpha=1 - beta2)
+                    col = state["exp_avg_sq_col"].mul_(beta2).add_(grad_sq.mean(dim=0), alpha=1 - beta2)
+                    exp_avg_sq = torch.outer(row, col) / row.mean().clamp_min(1e-30)
+
+                bias_correction1 = 1 - beta1 ** state["step"]
+                bias_correction2 = 1 - beta2 ** state["step"]
+                denom = (exp_avg_sq / bias_correction2).sqrt_().add_(group["eps"])
+                param.add_((exp_avg / denom).to(param.dtype), alpha=-group["lr"] / bias_correction1)
+        return loss
+
+
+def parameter_component(name):
+    """
+    Groups a HeteroGAE parameter name into a component: encoder layer and edge family, or decoder.
+    """
+    parts = name.split(".")
+    if parts[0] == "encoder":
+        relation = parts[3].strip("<>").split("___")[1]  # HeteroConv keys look like <src___relation___dst>
+        family = {"interact": "gene-gene", "has_target": "drug-gene", "get_target": "gene-drug"}.get(relation,
+                                                                                                  "drug-drug")
+        return f"encoder.{parts[1]} {family}"
+    if parts[0] == "decoder":
+        return f"decoder.{parts[1]}"
+    return parts[0]
+
+
+def memory_report(net, optimizer=None):
+    """
+    Bytes of parameters, gradients and optimizer state per component of the model.
+    Returns {component: {"count": number of tensors, "params": ..., "grads": ..., "optimizer": ...}}.
+    Parameters not initialized yet (lazy input sizes) are skipped.
+    """
+    report = defaultdict(lambda: {"count": 0, "params": 0, "grads": 0, "optimizer": 0})
+    for name, param in net.named_parameters():
+        if torch.nn.parameter.is_lazy(param):
+            continue
+        entry = report[parameter_component(name)]
+        entry["count"] += 1
+        entry["params"] += param.numel() * param.element_size()
+        if param.grad is not None:
+            entry["grads"] += param.grad.numel() * param.grad.element_size()
+        if optimizer is not None:
+            entry["optimizer"] += sum(value.numel() * value.element_size()
+                                      for value in optimizer.state.get(param, {}).values() if torch.is_tensor(value))
+    return dict(report)
+
+
+def print_memory_report(report):
+    print(f"| {'component':<28} | {'tensors':>7} | {'params MiB':>10} | {'grads MiB':>9} | {'optimizer MiB':>13} |")
+    total = {"count": 0, "params": 0, "grads": 0, "optimizer": 0}
+    for component, entry in sorted(report.items()) + [("total", total)]:
+        if component != "total":
+            for key in total:
+                total[key] += entry[key]
+        print(f"| {component:<28} | {entry['count']:>7} | {entry['params'] / 2**20:>10.2f} "
+              f"| {entry['grads'] / 2**20:>9.2f} | {entry['optimizer'] / 2**20:>13.2f} |")
@@ -0,0 +1,64 @@
+import copy
+
+import torch
+
+from null_models import PPI_EDGE_TYPE, DPI_EDGE_TYPE
+
+GENE_EDGE_TYPES = ["interact", "has_target", "get_target"]
+
+
+def drug_receptive_field(data, num_layers):
+    """
+    Genes whose input features can reach a drug embedding in an encoder of num_layers message-passing layers:
+    the targets of the drugs and the genes within num_layers - 1 PPI hops of a target.
+    Other genes only influence drug embeddings through genes of this set, at a depth the encoder does not reach.
+    Computed on the full graph, so it covers the message-passing graphs of all splits.
+    Returns a boolean mask over the genes.
+    """
+    num_genes = data["gene"].num_nodes
+    mask = torch.zeros(num_genes, dtype=torch.bool)
+    mask[data[DPI_EDGE_TYPE].edge_index[1]] = True
+    src, dst = data[PPI_EDGE_TYPE].edge_index
+    for _ in range(num_layers - 1):
+        reached = mask.clone()
+        reached[dst[mask[src]]] = True  # the PPI is undirected
+        reached[src[mask[dst]]] = True
+        mask = reached
+    return mask
+
+
+def prune_genes(data, gene_mask):
+    """
+    Restricts a graph (the full graph or a split built by prepare_split) to all drugs and the genes of gene_mask,
+    relabelled 0..n-1 in their original order. Gene edges with an endpoint outside the mask are dropped, and so
+    are the supervision edges of the gene edge types (the gene decoders are not trained on a pruned graph).
+    The one-hot gene features are restricted to the kept rows and columns, so they stay one-hot.
+    Returns a new graph that shares the tensors it does not prune with the input, which is not modified.
+    """
+    data = copy.copy(data)
+    new_index = torch.full((gene_mask.shape[0],), -1, dtype=torch.long)
+    new_index[gene_mask] = torch.arange(int(gene_mask.sum()))
+    kept_genes = gene_mask.nonzero().view(-1)
+    data["gene"].x = data["gene"].x.index_select(0, kept_genes).index_select(1, kept_genes)
+    if "num_nodes" in data["gene"]:
+        data["gene"].num_nodes = len(kept_genes)
+
+    for edge_type in data.edge_types:
+        src_type, relation, dst_type = edge_type
+        if relation not in GENE_EDGE_TYPES:
+            continue
+        store = data[edge_type]
+        edge_index = store.edge_index
+        keep = torch.ones(edge_index.shape[1], dtype=torch.bool)
+        for row, node_type in enumerate([src_type, dst_type]):
+            if node_type == "gene":
+                keep &= gene_mask[edge_index[row]]
+        edge_index = edge_index[:, keep].clone()
+        for row, node_type in enumerate([src_type, dst_type]):
+            if node_type == "gene":
+                edge_index[row] = new_index[edge_index[row]]
+        store.edge_index = edge_index
+        for key in ["edge_label", "edge_label_index"]:
+            if key in store:
+                del store[key]
+    return data
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import argparse
+
+import pandas as pd
+
+# Long ("tidy") layout: one row per (run config, seed, relation, metric).
+# Run-level scores are stored under the pseudo relation OVERALL.
+OVERALL = "__all__"
+
+CONFIG_COLUMNS = ["config", "num_bases", "randomize_ppi", "randomize_dpi", "lr", "dropout", "num_epoch", "patience",
+                  "config_hash", "config_json"]
+
+# Arguments that change what a run trains or measures. They are recorded together as config_json, and runs are
+# grouped by its hash; the legacy columns above are kept for filtering.
+MODEL_ARGS = ["encoder", "hidden_dims", "num_bases", "dropout", "lr", "dtype", "lean_optimizer", "optim_state_dtype",
+              "no_factored", "num_epoch", "patience", "patience_unit", "val_every", "val_subset_frac",
+              "val_subset_edges", "disjoint_train_ratio", "min_se_edges", "relations_per_step", "relation_sampling",
+              "randomize_ppi", "randomize_dpi", "null_replicates", "null_seed", "prune_genes",
+              "num_replicas"]  # num_replicas: runs of train_replicas.py, which share the split of their seed
+
+# metric name in the store -> key of the per-relation dict returned by run_experiment
+PER_RELATION_METRICS = {
+    "auroc": "roc_auc_dict",
+    "auprc": "prec_dict",
+    "ap50": "apk_dict",
+    "count": "counts_dict_1",
+    "mrr": "mrr_dict",  # filtered ranking metrics, with --ranking_eval
+    "hits1": "hits1_dict",
+    "hits3": "hits3_dict",
+    "hits10": "hits10_dict",
+}
+
+
+def config_name(args):
+    """
+    Short label of a run configuration, kept identical to the names of the old per-config pickle files
+    so results from before and after the switch to the columnar store can be told apart.
+    """
+    if args.randomize_ppi:
+        name = "results_randomized_both" if args.randomize_dpi else "results_randomized_ppi"
+        return name if args.num_bases is None else name + "_shared"
+    return "results" if args.num_bases is None else "results_shared_basis"
+
+
+def run_config(args):
+    """
+    Returns the configuration columns recorded with every row of a run.
+    """
+    config_json = json.dumps({name: getattr(args, name, None) for name in MODEL_ARGS}, sort_keys=True)
+    return {
+        "config": config_name(args),
+        "num_bases": -1 if args.num_bases is None else args.num_bases,  # -1: no basis decomposition
+        "randomize_ppi": bool(args.randomize_ppi),
+        "randomize_dpi": bool(args.randomize_dpi),
+        "lr": float(args.lr),
+        "dropout": float(args.dropout),
+        "num_epoch": int(args.num_epoch),
+        "patience": -1 if args.patience is None else int(args.patience),  # -1: no early stopping (sweeps)
+        "config_hash": hashlib.sha1(config_json.encode()).hexdigest()[:12],
+        "config_json": config_json,
+    }
+
+
+def results_to_frame(result, config, run_id=None):
+    """
+    Flattens the dictionary returned by run_experiment into the long layout of the store.
+    """
+    run_id = run_id or uuid.uuid4().hex
+    rows = []
+    for metric, dict_key in PER_RELATION_METRICS.items():
+        if metric in result:
+            rows.append((OVERALL, metric, float(result[metric])))
+        for relation, value in result.get(dict_key, {}).items():
+            rows.append((relation, metric, float(value)))
+
+    df = pd.DataFrame(rows, columns=["relation", "metric", "value"])
+    for column, value in config.items():
+        df[column] = value
+    df["seed"] = int(result["seed"])
+    df["null_replicate"] = int(result.get("null_replicate", -1))  # -1: not a NullGraphReplicates run
+    # seed is the seed of the split; train_replicas.py initializes replica k of a split with another seed
+    df["init_seed"] = int(result.get("init_seed", result["seed"]))
+    df["replica"] = int(result.get("replica", -1))  # -1: not a train_replicas.py run
+    df["run_id"] = run_id
+    df["timestamp"] = pd.Timestamp.now(tz="UTC")
+    df["relation"] = df["relation"].astype("category")
+    df["metric"] = df["metric"].astype("category")
+    return df[["run_id", "timestamp"] + CONFIG_COLUMNS + ["seed", "null_replicate", "init_seed", "replica", "relation",
+                                                                "metric", "value"]]
+
+
+def append_results(results_dir, result, config):
+    """
+    Appends the results of one run to the store located in results_dir.
+
+    Every call writes its own Parquet part file under a hive-style config=<name> partition, so
+    concurrent runs never touch the same file. The part is written to a temporary name and renamed
+    into place, which means readers never observe a half-written file.
+    """
+    partition = os.path.join(results_dir, f"config={config['config']}")
+    os.makedirs(partition, exist_ok=True)
+    df = results_to_frame(result, config)
+    # The partition value is encoded in the directory name and restored on read.
+    df = df.drop(columns=["config"])
+
+    file_name = f"part-{time.strftime('%Y%m%d%H%M%S')}-{df['run_id'].iloc[0]}.parquet"
+    tmp_path = os.path.join(partition, "." + file_name + ".tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(partition, file_name))
+    return os.path.join(partition, file_name)
+
+
+def load_results(results_dir, columns=None, filters=None):
+    """
+    Reads the store as a single DataFrame.
+    Only the requested columns are decoded, and filters (pyarrow DNF, e.g. [("metric", "==", "auroc")])
+    are pushed down so partitions and row groups that cannot match are skipped.
+    Parts written before a column was added read it as null.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(results_dir, format="parquet", partitioning="hive")
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()] +
+                              [dataset.partitioning.schema], promote_options="permissive")
+    return pd.read_parquet(results_dir, columns=columns, filters=filters, schema=schema)
+
+
+def summarize(results_dir, metric="auroc", relation=OVERALL):
+    """
+    Mean, standard deviation and number of seeds of a metric for every configuration in the store, one row per
+    config_hash (runs stored before config_hash was recorded are grouped on the legacy columns only).
+    """
+    df = load_results(results_dir, columns=CONFIG_COLUMNS + ["seed", "value"],
+                      filters=[("metric", "==", metric), ("relation", "==", relation)])
+    df["config"] = df["config"].astype(str)
+    return df.groupby(CONFIG_COLUMNS, observed=True, dropna=False)["value"].agg(["mean", "std", "count"]).reset_index()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a results store")
+    parser.add_argument("--results_dir", type=str, default="./results", help="results store directory")
+    parser.add_argument("--metric", type=str, default="auroc", help="one of " + ", ".join(PER_RELATION_METRICS))
+    parser.add_argument("--relation", type=str, default=OVERALL, help="side effect to summarize (default: overall)")
+    args = parser.parse_args()
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", 200):
+        print(summarize(args.results_dir, args.metric, args.relation))
@@ -0,0 +1,81 @@
+import queue
+import threading
+
+import torch
+
+
+def sample_negative_edges(pos_edge_index, num_nodes, generator, num_neg_samples=None):
+    """
+    Samples node pairs that are not in pos_edge_index, like pyg_utils.negative_sampling with
+    bipartite num_nodes = (num_src, num_dst), but drawing only from the given torch.Generator.
+    pyg_utils.negative_sampling uses python's global random module, whose draws interleave
+    non-deterministically when sampling runs in a background thread.
+    """
+    num_src, num_dst = num_nodes
+    population = num_src * num_dst
+    if num_neg_samples is None:
+        num_neg_samples = pos_edge_index.shape[1]
+    pos_idx = pos_edge_index[0] * num_dst + pos_edge_index[1]  # linear index of every positive pair
+    prob = 1. - pos_idx.numel() / population  # probability that a random pair is a negative
+    sample_size = int(1.1 * num_neg_samples / max(prob, 1e-12))  # (over)-sample size
+
+    neg_idx = pos_idx.new_empty(0)
+    for _ in range(3):  # number of tries to collect enough negatives
+        rnd = torch.randint(population, (sample_size,), generator=generator)
+        rnd = torch.unique(rnd)  # sorted, so shuffle again below before truncating
+        rnd = rnd[~torch.isin(rnd, pos_idx) & ~torch.isin(rnd, neg_idx)]
+        rnd = rnd[torch.randperm(rnd.numel(), generator=generator)]
+        neg_idx = torch.cat([neg_idx, rnd])
+        if neg_idx.numel() >= num_neg_samples:
+            break
+    neg_idx = neg_idx[:num_neg_samples]
+    return torch.stack([neg_idx // num_dst, neg_idx % num_dst]).to(pos_edge_index.device)
+
+
+class EdgeLabelPrefetcher:
+    """
+    Prepares the supervision batches of upcoming epochs in a background thread.
+
+    sample_fn(epoch) builds the batch of an epoch, and at most depth batches are kept ready in a bounded
+    queue, so sampling for epoch t+1 overlaps with the forward/backward pass of epoch t. As long as
+    sample_fn only draws from a generator seeded by the epoch, the batches do not depend on thread timing.
+    """
+
+    def __init__(self, sample_fn, num_epochs, depth=2):
+        self.sample_fn = sample_fn
+        self.num_epochs = num_epochs
+        self.queue = queue.Queue(maxsize=depth)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+
+    def _produce(self):
+        try:
+            for epoch in range(self.num_epochs):
+                batch = self.sample_fn(epoch)
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put((epoch, batch, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if self.stop_event.is_set():
+                    return
+        except Exception as error:  # re-raised in the consumer
+            self.queue.put((None, None, error))
+
+    def get(self, epoch):
+        """
+        Returns the batch of the given epoch. Epochs must be requested in order.
+        """
+        produced_epoch, batch, error = self.queue.get()
+        if error is not None:
+            raise error
+        assert produced_epoch == epoch, f"expected the batch of epoch {epoch}, got {produced_epoch}"
+        return batch
+
+    def close(self):
+        self.stop_event.set()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.thread.join()
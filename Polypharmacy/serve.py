@@ -0,0 +1,269 @@
+# serve.py
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from collections import deque
+
+import torch
+
+from export_model import load_scorer
+
+# Only torch is needed: the server scores with an artefact written by export_model.py (full precision or
+# quantized), which holds the final drug embeddings and the DEDICOM parameters.
+
+# Upper bound on the JSON size of one pair of a request, ["CID000002173", "CID000003345", "C0000729"], or of its
+# score. Request lines of a full batch must fit in the stream buffer, whose default limit is 64 KiB.
+BYTES_PER_PAIR = 64
+
+
+class LatencyStats:
+    """
+    Latencies of the last window requests and counters since start, for p50/p99 and throughput reports.
+    """
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.pairs = 0
+        self.batches = 0
+
+    def record_batch(self, latencies, num_pairs):
+        self.latencies.extend(latencies)
+        self.requests += len(latencies)
+        self.pairs += num_pairs
+        self.batches += 1
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        latencies = torch.tensor(list(self.latencies) or [0.0])
+        return {
+            "requests": self.requests,
+            "pairs": self.pairs,
+            "batches": self.batches,
+            "mean_requests_per_batch": self.requests / max(self.batches, 1),
+            "p50_ms": 1000 * torch.quantile(latencies, 0.5).item(),
+            "p99_ms": 1000 * torch.quantile(latencies, 0.99).item(),
+            "requests_per_s": self.requests / elapsed,
+            "pairs_per_s": self.pairs / elapsed,
+        }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent scoring requests into batches.
+
+    A batch is closed when it holds max_batch_pairs pairs or max_wait_ms after its first request arrived,
+    whichever comes first, and is scored by a single call of the scorer in a worker thread, so the event loop
+    keeps accepting requests while a batch is scored.
+    """
+
+    def __init__(self, scorer, max_batch_pairs=4096, max_wait_ms=2.0, stats=None):
+        self.scorer = scorer
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats or LatencyStats()
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def score(self, src, dst, relation):
+        """
+        Probabilities of the pairs of one request, scored as part of the next batch.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((src, dst, relation, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            num_pairs = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while num_pairs < self.max_batch_pairs:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                num_pairs += len(item[0])
+
+            src = torch.tensor([index for item in batch for index in item[0]], dtype=torch.long)
+            dst = torch.tensor([index for item in batch for index in item[1]], dtype=torch.long)
+            relation = torch.tensor([index for item in batch for index in item[2]], dtype=torch.long)
+            try:
+                scores = await loop.run_in_executor(None, self._score_batch, src, dst, relation)
+            except Exception as error:
+                for item in batch:
+                    item[3].set_exception(error)
+                continue
+            done = time.perf_counter()
+            offset = 0
+            for item in batch:
+                item[3].set_result(scores[offset: offset + len(item[0])])
+                offset += len(item[0])
+            self.stats.record_batch([done - item[4] for item in batch], num_pairs)
+
+    def _score_batch(self, src, dst, relation):
+        with torch.no_grad():
+            return self.scorer(src, dst, relation).tolist()
+
+
+class ScoringServer:
+    """
+    JSON lines over a Unix socket or localhost TCP. A request is one line,
+    {"id": ..., "pairs": [[drug_1, drug_2, side_effect], ...]} with STITCH drug ids and side effect ids, and is
+    answered by {"id": ..., "scores": [...]} with one probability per pair. {"op": "metrics"} returns the
+    latency and throughput statistics. Request lines are read up to max_request_pairs pairs (by default
+    max_batch_pairs); longer lines are answered with an error and end the connection.
+    """
+
+    def __init__(self, scorer, metadata, max_batch_pairs=4096, max_wait_ms=2.0, max_request_pairs=None):
+        self.line_limit = max(2 ** 16, BYTES_PER_PAIR * (max_request_pairs or max_batch_pairs))
+        self.drug_2_idx = {drug: idx for idx, drug in enumerate(metadata["drugs"])}
+        self.relation_2_idx = {relation: idx for idx, relation in enumerate(metadata["relations"])}
+        self.batcher = MicroBatcher(scorer, max_batch_pairs, max_wait_ms)
+
+    async def handle_request(self, request):
+        if not isinstance(request, dict):
+            return {"error": "a request must be a JSON object"}
+        if request.get("op") == "metrics":
+            return {"id": request.get("id"), "metrics": self.batcher.stats.summary()}
+        try:
+            src, dst, relation = zip(*[(self.drug_2_idx[drug_1], self.drug_2_idx[drug_2], self.relation_2_idx[se])
+                                       for drug_1, drug_2, se in request["pairs"]])
+        except (KeyError, TypeError, ValueError) as error:
+            return {"id": request.get("id"), "error": f"invalid request: {error!r}"}
+        scores = await self.batcher.score(src, dst, relation)
+        return {"id": request.get("id"), "scores": scores}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # longer than line_limit: the rest of the line is unread, so give up the connection
+                    response = {"error": f"request longer than {self.line_limit} bytes"}
+                    writer.write((json.dumps(response) + "\n").encode())
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    response = await self.handle_request(json.loads(line))
+                except (json.JSONDecodeError, UnicodeDecodeError) as error:
+                    response = {"error": f"invalid JSON: {error}"}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, socket_path=None, host="127.0.0.1", port=8765):
+        self.batcher.start()
+        if socket_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection, path=socket_path, limit=self.line_limit)
+        return await asyncio.start_server(self.handle_connection, host=host, port=port, limit=self.line_limit)
+
+
+async def run_load(socket_path, metadata, num_clients, requests_per_client, pairs_per_request, seed=0):
+    """
+    Load generator: num_clients connections each sending requests_per_client random requests one after the
+    other. Returns the client-side latencies (seconds) and the wall time.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    drugs, relations = metadata["drugs"], metadata["relations"]
+    latencies = []
+
+    async def client():
+        reader, writer = await asyncio.open_unix_connection(
+            socket_path, limit=max(2 ** 16, BYTES_PER_PAIR * pairs_per_request))
+        for _ in range(requests_per_client):
+            drug_idx = torch.randint(len(drugs), (pairs_per_request, 2), generator=generator).tolist()
+            relation_idx = torch.randint(len(relations), (pairs_per_request,), generator=generator).tolist()
+            pairs = [[drugs[a], drugs[b], relations[r]] for (a, b), r in zip(drug_idx, relation_idx)]
+            start = time.perf_counter()
+            writer.write((json.dumps({"pairs": pairs}) + "\n").encode())
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            assert "scores" in response, response
+            latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(num_clients)])
+    return latencies, time.perf_counter() - start
+
+
+async def benchmark(scorer, metadata, args):
+    """
+    Client-side p50/p99 latency and throughput under concurrent load, without batching (one request per
+    scorer call) and with the configured micro-batching window.
+    """
+    for name, max_batch_pairs, max_wait_ms in [("no batching", 1, 0.0),
+                                               ("micro-batching", args.max_batch_pairs, args.max_wait_ms)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, "scorer.sock")
+            server = ScoringServer(scorer, metadata, max_batch_pairs, max_wait_ms,
+                                   max(args.max_batch_pairs, args.pairs_per_request))
+            unix_server = await server.start(socket_path)
+            latencies, elapsed = await run_load(socket_path, metadata, args.clients, args.requests_per_client,
+                                                args.pairs_per_request)
+            unix_server.close()
+            await unix_server.wait_closed()
+            await server.batcher.stop()
+        latencies = torch.tensor(latencies)
+        print(f"| {name} | p50: {1000 * torch.quantile(latencies, 0.5).item():.2f}ms "
+              f"| p99: {1000 * torch.quantile(latencies, 0.99).item():.2f}ms "
+              f"| {len(latencies) / elapsed:.0f} requests/s "
+              f"| {server.batcher.stats.summary()['mean_requests_per_batch']:.1f} requests per batch |")
+
+
+async def serve(scorer, metadata, args):
+    server = ScoringServer(scorer, metadata, args.max_batch_pairs, args.max_wait_ms)
+    async_server = await server.start(args.socket, args.host, args.port)
+    print(f"Serving {len(metadata['relations'])} side effects for {len(metadata['drugs'])} drugs on "
+          f"{args.socket or f'{args.host}:{args.port}'}")
+    try:
+        async with async_server:
+            await async_server.serve_forever()
+    finally:
+        print(json.dumps(server.batcher.stats.summary()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drug pair side effect scoring server with micro-batching")
+    parser.add_argument("--scorer", type=str, default="./scorer.pt2", help="artefact written by export_model.py")
+    parser.add_argument("--socket", type=str, default=None, help="Unix socket path (default: localhost TCP)")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="TCP host, local only by default")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--max_batch_pairs", type=int, default=4096, help="close a batch at this many pairs")
+    parser.add_argument("--max_wait_ms", type=float, default=2.0,
+                        help="close a batch this long after its first request")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads used for scoring")
+    parser.add_argument("--benchmark", action="store_true", help="run the load generator instead of serving")
+    parser.add_argument("--clients", type=int, default=64, help="concurrent clients of the load generator")
+    parser.add_argument("--requests_per_client", type=int, default=100, help="requests sent by every client")
+    parser.add_argument("--pairs_per_request", type=int, default=8, help="drug pairs per request")
+    args = parser.parse_args()
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    scorer, metadata = load_scorer(args.scorer)
+    asyncio.run(benchmark(scorer, metadata, args) if args.benchmark else serve(scorer, metadata, args))
@@ -0,0 +1,256 @@
+# sweep.py
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import torch
+import torch.nn as nn
+import torch_geometric
+
+from main_gae import build_parser
+from results_store import append_results, run_config
+from train_hetero_gae import prepare_split, build_model, build_optimizer, train_step, validate, test_model
+
+_split = None  # (data, train_data, valid_data, test_data), loaded once per worker process
+
+
+def _init_worker(split_path, num_threads):
+    global _split
+    torch.set_num_threads(num_threads)
+    _split = torch.load(split_path, weights_only=False)
+
+
+def parse_num_bases(value):
+    return None if value.lower() == "none" else int(value)
+
+
+def parse_hidden_dims(value):
+    return [int(dim) for dim in value.split(",")]
+
+
+def generate_trials(args):
+    """
+    Cartesian product of the hyperparameter grids, optionally subsampled to num_trials configurations.
+    A grid that is not given falls back to the single value of the corresponding main_gae.py argument.
+    """
+    grid = {
+        "lr": args.lr_grid or [args.lr],
+        "dropout": args.dropout_grid or [args.dropout],
+        "num_bases": args.num_bases_grid or [args.num_bases],
+        "hidden_dims": args.hidden_dims_grid or [args.hidden_dims],
+    }
+    configs = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    if args.num_trials is not None and args.num_trials < len(configs):
+        configs = random.Random(args.seed).sample(configs, args.num_trials)
+    return [{"trial_id": trial_id, "config": config} for trial_id, config in enumerate(configs)]
+
+
+def rung_budgets(min_epochs, max_epochs, eta):
+    """
+    Epoch budgets of the successive halving rungs: min_epochs * eta^k, capped by max_epochs.
+    """
+    budgets = []
+    budget = min_epochs
+    while budget < max_epochs:
+        budgets.append(budget)
+        budget *= eta
+    budgets.append(max_epochs)
+    return budgets
+
+
+def run_trial(trial, budget, base_args, run_dir):
+    """
+    Trains a trial until it has seen budget epochs in total, resuming from the state it was left in after
+    its previous rung, and returns the trajectory of the epochs run by this call.
+    """
+    data, train_data, valid_data, test_data = _split
+    edge_types = data.edge_types
+    args = argparse.Namespace(**{**vars(base_args), **trial["config"]})
+    state_path = os.path.join(run_dir, f"trial_{trial['trial_id']}.pt")
+
+    # Every trial starts from the same seed, so configurations are compared on equal footing
+    torch_geometric.seed_everything(args.seed)
+    net = build_model(data, train_data, args)
+    state = {"epoch": 0, "best_val_roc": 0, "best_model": None, "sweep_id": trial["sweep_id"],
+             "config": trial["config"]}
+    if os.path.exists(state_path):
+        state = torch.load(state_path, weights_only=False)
+        # run_dir is private to one sweep, so a state of another sweep or configuration is a bug, not a resume
+        if state.get("sweep_id") != trial["sweep_id"] or state.get("config") != trial["config"]:
+            raise RuntimeError(f"{state_path} belongs to sweep {state.get('sweep_id')} with config "
+                               f"{state.get('config')}, not to trial {trial}")
+        net.load_state_dict(state["model"])
+    optimizer = build_optimizer(net.parameters(), args)
+    if "optimizer" in state:
+        optimizer.load_state_dict(state["optimizer"])
+    loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
+    torch_geometric.seed_everything(args.seed + state["epoch"])  # fresh negatives after a resume
+
+    trajectory = []
+    for epoch in range(state["epoch"], budget):
+        start = time.time()
+        loss = train_step(net, optimizer, loss_fn, train_data, edge_types, args.device)
+        val_roc = validate(net, valid_data, edge_types)
+        if state["best_val_roc"] < val_roc:
+            state["best_val_roc"] = val_roc
+            state["best_model"] = {key: value.clone() for key, value in net.state_dict().items()}
+        trajectory.append({"trial_id": trial["trial_id"], "epoch": epoch, "loss": loss, "val_auroc": val_roc,
+                           "time": time.time() - start})
+
+    state.update(epoch=max(state["epoch"], budget), model=net.state_dict(), optimizer=optimizer.state_dict())
+    torch.save(state, state_path)
+    return {"trial_id": trial["trial_id"], "best_val_roc": state["best_val_roc"], "trajectory": trajectory}
+
+
+def test_trial(trial, base_args, run_dir):
+    """
+    Test metrics of the best validation state of a trial.
+    """
+    data, train_data, valid_data, test_data = _split
+    args = argparse.Namespace(**{**vars(base_args), **trial["config"]})
+    net = build_model(data, train_data, args)
+    state = torch.load(os.path.join(run_dir, f"trial_{trial['trial_id']}.pt"), weights_only=False)
+    net.load_state_dict(state["best_model"])
+    return test_model(net, test_data, data.edge_types)
+
+
+def run_sweep(args):
+    """
+    Asynchronous successive halving (ASHA) over the hyperparameter grid.
+
+    All trials share one data split, computed once and loaded by each worker process. A trial that
+    finished rung k is promoted to rung k+1 as soon as it ranks in the top 1/eta of the trials that
+    completed rung k, so workers never wait for a whole rung to finish. Idle workers start new trials.
+    Each promotion resumes the trial from its saved model and optimizer state.
+    Trial states and logs are written to a directory of their own, <sweep_dir>/sweep_<id>, so a new sweep
+    in the same sweep_dir never resumes the trials of an earlier one; only the data split is shared.
+    """
+    os.makedirs(args.sweep_dir, exist_ok=True)
+    sweep_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+    run_dir = os.path.join(args.sweep_dir, f"sweep_{sweep_id}")
+    os.makedirs(run_dir)
+    # With --prune_genes the shared split keeps the receptive field of the deepest encoder of the grid,
+    # which contains the receptive fields of the shallower ones
+    deepest = max(args.hidden_dims_grid or [args.hidden_dims], key=len)
+    split_path = os.path.join(args.sweep_dir, f"split_seed{args.seed}_ppi{int(args.randomize_ppi)}"
+                                              f"_dpi{int(args.randomize_dpi)}_disjoint{args.disjoint_train_ratio}"
+                                              f"_se{args.min_se_edges}_{args.dtype}"
+                                              f"{f'_prune{len(deepest)}' if args.prune_genes else ''}.pt")
+    if not os.path.exists(split_path):
+        torch_geometric.seed_everything(args.seed)
+        torch.save(prepare_split(argparse.Namespace(**{**vars(args), "hidden_dims": deepest})), split_path)
+
+    trials = [{**trial, "sweep_id": sweep_id} for trial in generate_trials(args)]
+    budgets = rung_budgets(args.min_epochs, args.num_epoch, args.eta)
+    print(f"Sweeping {len(trials)} configurations over rungs of {budgets} epochs, logging to {run_dir}")
+    with open(os.path.join(run_dir, "trials.json"), "w") as f:
+        json.dump(trials, f, indent=1)
+
+    rung_scores = [{} for _ in budgets]  # rung -> trial_id -> best validation ROC-AUC
+    promoted = [set() for _ in budgets]
+    pending = list(trials)
+
+    def next_job():
+        for rung in reversed(range(len(budgets) - 1)):
+            scores = rung_scores[rung]
+            top = sorted(scores, key=scores.get, reverse=True)[:len(scores) // args.eta]
+            for trial_id in top:
+                if trial_id not in promoted[rung]:
+                    promoted[rung].add(trial_id)
+                    return trials[trial_id], rung + 1
+        if pending:
+            return pending.pop(0), 0
+        return None
+
+    log_file = open(os.path.join(run_dir, "trajectories.jsonl"), "w")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.num_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(split_path, args.threads_per_trial)) as pool:
+        running = {}
+        while True:
+            while len(running) < args.num_workers:
+                job = next_job()
+                if job is None:
+                    break
+                trial, rung = job
+                running[pool.submit(run_trial, trial, budgets[rung], args, run_dir)] = (trial, rung)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial, rung = running.pop(future)
+                result = future.result()
+                rung_scores[rung][trial["trial_id"]] = result["best_val_roc"]
+                for entry in result["trajectory"]:
+                    log_file.write(json.dumps({**entry, "rung": rung}) + "\n")
+                log_file.flush()
+                print(f"| Trial: {trial['trial_id']} | Rung: {rung} | Epochs: {budgets[rung]} "
+                      f"| Best Val ROC: {result['best_val_roc']} | Config: {trial['config']}")
+        log_file.close()
+
+        top_rung = max(rung for rung in range(len(budgets)) if rung_scores[rung])
+        best_id = max(rung_scores[top_rung], key=rung_scores[top_rung].get)
+        best_trial = trials[best_id]
+        result = pool.submit(test_trial, best_trial, args, run_dir).result()
+
+    print("-" * 100)
+    print(f"Best configuration: {best_trial['config']} (trial {best_id}, rung {top_rung})")
+    print(f'| Test AUROC: {result["auroc"]} | Test AUPRC: {result["auprc"]} | Test AP@50: {result["ap50"]}')
+    # the best trial was trained for the budget of its rung
+    best_args = argparse.Namespace(**{**vars(args), **best_trial["config"], "num_epoch": budgets[top_rung]})
+    append_results(args.results_dir, {"seed": args.seed, **result}, run_config(best_args))
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump({"best_trial": best_trial, "rung": top_rung, "budgets": budgets,
+                   "rung_scores": rung_scores, "test_auroc": result["auroc"], "test_auprc": result["auprc"],
+                   "test_ap50": result["ap50"]}, f, indent=1)
+    return best_trial, result
+
+
+# Options of main_gae.py that run_trial does not implement; the trials validate every epoch and train for their
+# rung budgets without early stopping
+UNSUPPORTED_OPTIONS = {
+    "pretrained": None,
+    "compile": False,
+    "memory_report": False,
+    "prefetch": 0,
+    "relations_per_step": None,
+    "relation_sampling": "uniform",
+    "val_every": 1,
+    "val_subset_frac": 1.0,
+    "val_subset_edges": None,
+    "patience": None,
+    "patience_unit": "epoch",
+    "ranking_eval": False,
+    "null_replicates": 0,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep with asynchronous successive halving",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--lr_grid", type=float, nargs="+", default=None, help="learning rates to try")
+    parser.add_argument("--dropout_grid", type=float, nargs="+", default=None, help="dropout rates to try")
+    parser.add_argument("--num_bases_grid", type=parse_num_bases, nargs="+", default=None,
+                        help="numbers of basis functions to try ('none' for no basis decomposition)")
+    parser.add_argument("--hidden_dims_grid", type=parse_hidden_dims, nargs="+", default=None,
+                        help="comma separated encoder hidden dimensions to try, e.g. 64,32 32,16")
+    parser.add_argument("--num_trials", type=int, default=None, help="randomly subsample the grid")
+    parser.add_argument("--min_epochs", type=int, default=10, help="epoch budget of the first rung")
+    parser.add_argument("--eta", type=int, default=3, help="keep the top 1/eta trials of each rung")
+    parser.add_argument("--num_workers", type=int, default=max(1, (os.cpu_count() or 1) // 4),
+                        help="number of trials trained concurrently")
+    parser.add_argument("--threads_per_trial", type=int, default=4, help="torch threads per worker process")
+    parser.add_argument("--sweep_dir", type=str, default="./sweep", help="directory for trial states and logs")
+    parser.set_defaults(patience=None)  # recorded in the results store as not used
+    args = parser.parse_args()
+    for option, default in UNSUPPORTED_OPTIONS.items():
+        if getattr(args, option) != default:
+            parser.error(f"--{option} is not supported by sweep.py")
+    run_sweep(args)
@@ -0,0 +1,77 @@
+# synthetic_data.py
+
+import argparse
+import csv
+import os
+import random
+
+# Graphs used to benchmark the training variants without the Decagon files. All have 300 drugs and 150 side effects
+# of 500 to 1500 drug pairs each; they differ in the size of the gene subgraph.
+SYNTHETIC_GRAPHS = {
+    "small": dict(num_genes=300, num_ppi_edges=3000, targets_per_drug=5),
+    "medium": dict(num_genes=3000, num_ppi_edges=20000, targets_per_drug=10),
+    # As many genes as Decagon with a sparse PPI, and drug targets concentrated on 400 genes
+    "sparse_ppi": dict(num_genes=19000, num_ppi_edges=59000, targets_per_drug=5, num_target_genes=400),
+}
+
+
+def write_synthetic_data(data_dir, num_genes, num_ppi_edges, targets_per_drug, num_target_genes=None,
+                         num_drugs=300, num_side_effects=150, min_pairs=500, max_pairs=1500, seed=0):
+    """
+    Writes random bio-decagon-combo.csv, bio-decagon-ppi.csv and bio-decagon-targets.csv files in the Decagon
+    format to data_dir: every side effect links a uniformly drawn set of drug pairs, the PPI has num_ppi_edges
+    distinct gene pairs, and every drug targets targets_per_drug genes among num_target_genes randomly chosen
+    genes (all genes by default).
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    drugs = [f"CID{i:06d}" for i in range(num_drugs)]
+    genes = list(range(1, num_genes + 1))
+
+    with open(os.path.join(data_dir, "bio-decagon-combo.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["STITCH 1", "STITCH 2", "Polypharmacy Side Effect", "Side Effect Name"])
+        pairs = [(drug_1, drug_2) for i, drug_1 in enumerate(drugs) for drug_2 in drugs[i + 1:]]
+        for k in range(num_side_effects):
+            side_effect = f"C{k:04d}"
+            for drug_1, drug_2 in rng.sample(pairs, rng.randint(min_pairs, max_pairs)):
+                writer.writerow([drug_1, drug_2, side_effect, "name" + side_effect])
+
+    with open(os.path.join(data_dir, "bio-decagon-ppi.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Gene 1", "Gene 2"])
+        seen = set()
+        while len(seen) < num_ppi_edges:
+            gene_1, gene_2 = rng.sample(genes, 2)
+            if (gene_1, gene_2) in seen or (gene_2, gene_1) in seen:
+                continue
+            seen.add((gene_1, gene_2))
+            writer.writerow([gene_1, gene_2])
+
+    target_genes = rng.sample(genes, num_target_genes) if num_target_genes is not None else genes
+    with open(os.path.join(data_dir, "bio-decagon-targets.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["STITCH", "Gene"])
+        for drug in drugs:
+            for gene in rng.sample(target_genes, targets_per_drug):
+                writer.writerow([drug, gene])
+
+
+def synthetic_working_dir(graph, root="./synthetic", seed=0):
+    """
+    Directory holding Data/ files of the named synthetic graph, written on first use. data.load_data reads
+    ./Data, so scripts run from this directory train on the synthetic graph.
+    """
+    working_dir = os.path.abspath(os.path.join(root, f"{graph}_seed{seed}"))
+    if not os.path.exists(os.path.join(working_dir, "Data", "bio-decagon-targets.csv")):
+        write_synthetic_data(os.path.join(working_dir, "Data"), seed=seed, **SYNTHETIC_GRAPHS[graph])
+    return working_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic graph in the Decagon csv format")
+    parser.add_argument("--graph", type=str, default="medium", choices=list(SYNTHETIC_GRAPHS))
+    parser.add_argument("--data_dir", type=str, default="./Data", help="directory of the csv files")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the graph")
+    args = parser.parse_args()
+    write_synthetic_data(args.data_dir, seed=args.seed, **SYNTHETIC_GRAPHS[args.graph])
@@ -3,43 +3,145 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch_geometric
-import torch_geometric.transforms as pyg_T
 import torch_geometric.utils as pyg_utils
 
 from models.hetero_gae import HeteroGAE
-from metrics import *
-from metrics import *
+from models.sign_encoder import SIGNGAE
+from metrics import cal_roc_auc_score_per_side_effect, cal_average_precision_score_per_side_effect, cal_apk, \
+    cal_filtered_ranking_metrics
 import time
 import numpy as np
-from data import *
+from data import load_data
+from receptive_field import drug_receptive_field, prune_genes
+from optim import LeanAdam, STATE_DTYPES, memory_report, print_memory_report
+from sampling import sample_negative_edges, EdgeLabelPrefetcher
 import os
+import random
 import warnings
 
 warnings.filterwarnings("ignore")
 
-def run_experiment(seed, args):
-
-    # parser = argparse.ArgumentParser(description="Polypharmacy Side Effect Prediction")
-    # parser.add_argument("--seed", type=int, default=1, help="random seed")
-    # parser.add_argument("--num_epoch", type=int, default=300, help="number of epochs")
-    # parser.add_argument("--lr", type=float, default=1e-3, help="learning rate")
-    # parser.add_argument("--chkpt_dir", type=str, default="./checkpoint/", help="checkpoint directory")
-    # parser.add_argument("--dropout", type=float, default=0.1, help="dropout rate")
-    # parser.add_argument("--device", type=str, default="cuda:0", help="training device")
-    # parser.add_argument("--pretrained", type=str, default=None, help="pretrained model checkpoint path")
-    # parser.add_argument("--num_bases", type=int, default=None, help="number of basis functions")
-    # parser.add_argument("--save_model", action="store_true", help="save model")
-    # parser.add_argument("--randomize_ppi", action="store_true", help="randomize protein interactions")
-    # parser.add_argument("--randomize_dpi", action="store_true", help="randomize drug protein interactions")
-    # args = parser.parse_args()
-    torch_geometric.seed_everything(seed)
-    print("Running experiment with seed: ", seed)
-    print("Load data")
-    if args.randomize_ppi:
-        print("Not Using Protein-Protein Interactions")
-    if args.randomize_dpi:
-        print("Not Using Drug-Protein Interactions")
-    data = load_data(args.randomize_ppi, args.randomize_dpi)
+DTYPES = {"float64": torch.float64, "float32": torch.float32}
+
+
+def sample_edge_labels(data, edge_types, generator=None):
+    """
+    Pairs the positive supervision edges of every relation (except "get_target") with the same number of
+    negative edges drawn by pyg_utils.negative_sampling, or by sample_negative_edges from the given
+    torch.Generator if there is one.
+    Returns edge_label_index_dict keyed by edge type and edge_label_dict keyed by relation.
+    """
+    pos_edge_label_index_dict = data.edge_label_index_dict  # get the positive edge indices
+    edge_label_index_dict = {}  # initialize the dictionary for the edge indices
+    edge_label_dict = {}  # initialize the dictionary for the edge labels
+    for edge_type in edge_types:  # for each edge type
+        src, relation, dst = edge_type  # get the source, relation, and destination node types
+        if relation == "get_target":  # skip the "get_target" relation
+            continue
+        if edge_type not in pos_edge_label_index_dict:  # no supervision edges (gene edges of a pruned graph)
+            continue
+        num_nodes = (data.x_dict[src].shape[0], data.x_dict[dst].shape[0])
+        if generator is None:
+            neg_edge_label_index = pyg_utils.negative_sampling(pos_edge_label_index_dict[edge_type],
+                                                               num_nodes=num_nodes)
+        else:
+            neg_edge_label_index = sample_negative_edges(pos_edge_label_index_dict[edge_type], num_nodes, generator)
+        # negative sampling for the edge indices
+        edge_label_index_dict[edge_type] = torch.cat([pos_edge_label_index_dict[edge_type],
+                                                      neg_edge_label_index], dim=-1)
+
+        pos_label = torch.ones(pos_edge_label_index_dict[edge_type].shape[1])  # positive edge labels
+        neg_label = torch.zeros(neg_edge_label_index.shape[1])  # negative edge labels
+        edge_label_dict[relation] = torch.cat([pos_label, neg_label], dim=0)  # concatenate the edge labels
+    return edge_label_index_dict, edge_label_dict
+
+
+def predict_edge_labels(net, z_dict, edge_label_index_dict):
+    """
+    Decodes the given edges and returns their predicted probabilities on the cpu, keyed by relation.
+    """
+    edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)
+    for relation in edge_pred.keys():
+        edge_pred[relation] = F.sigmoid(edge_pred[relation]).cpu()
+    return edge_pred
+
+
+def generate_validation_subset(data, edge_types, fraction, max_edges=None, seed=0):
+    """
+    Builds a fixed validation batch over a stratified subset of the drug-drug relations.
+
+    Relations are ordered by their number of validation edges and every k-th one is kept, so the subset
+    covers rare and frequent side effects alike. At most max_edges positive edges are kept per relation
+    and the negatives are drawn once, which makes the subset score deterministic for a given model.
+    Returns the subset edge types, edge_label_index_dict and edge_label_dict.
+    """
+    pos_edge_label_index_dict = data.edge_label_index_dict
+    drug_edge_types = [edge_type for edge_type in edge_types
+                       if edge_type[1] not in ["interact", "has_target", "get_target"]]
+    drug_edge_types.sort(key=lambda edge_type: pos_edge_label_index_dict[edge_type].shape[1])
+    step = max(1, round(1 / fraction))
+    subset_edge_types = drug_edge_types[step // 2::step] or drug_edge_types[:1]
+
+    generator = torch.Generator().manual_seed(seed)
+    edge_label_index_dict = {}
+    edge_label_dict = {}
+    # pyg_utils.negative_sampling draws from python's random module: reseed it for the fixed negatives
+    # and restore it afterwards, so the training run sees the same random stream as without the subset
+    random_state = random.getstate()
+    random.seed(seed)
+    for edge_type in subset_edge_types:
+        src, relation, dst = edge_type
+        pos_edge_index = pos_edge_label_index_dict[edge_type]
+        if max_edges is not None and pos_edge_index.shape[1] > max_edges:
+            keep = torch.randperm(pos_edge_index.shape[1], generator=generator)[:max_edges]
+            pos_edge_index = pos_edge_index[:, keep]
+        num_nodes = (data.x_dict[src].shape[0], data.x_dict[dst].shape[0])
+        neg_edge_index = pyg_utils.negative_sampling(pos_edge_index, num_nodes=num_nodes)
+        edge_label_index_dict[edge_type] = torch.cat([pos_edge_index, neg_edge_index], dim=-1)
+        edge_label_dict[relation] = torch.cat([torch.ones(pos_edge_index.shape[1]),
+                                               torch.zeros(neg_edge_index.shape[1])], dim=0)
+    random.setstate(random_state)
+    return subset_edge_types, edge_label_index_dict, edge_label_dict
+
+
+def shares_message_passing_graph(data_a, data_b):
+    """
+    True if both splits run message passing over the same nodes and edges, in which case the encoder
+    produces the same node embeddings for both.
+    """
+    if set(data_a.edge_index_dict.keys()) != set(data_b.edge_index_dict.keys()):
+        return False
+    for node_type in data_a.node_types:
+        if data_a[node_type].num_nodes != data_b[node_type].num_nodes:
+            return False
+    return all(torch.equal(edge_index, data_b[edge_type].edge_index)
+               for edge_type, edge_index in data_a.edge_index_dict.items())
+
+
+def parameter_version(net):
+    """
+    Sum of the in-place version counters of the model parameters. optimizer.step() and load_state_dict()
+    update parameters in place, so the value changes whenever the weights do.
+    """
+    return sum(param._version for param in net.parameters())
+
+
+def prepare_split(args, data=None):
+    """
+    Loads the data, unless an already loaded graph (e.g. a null-model replicate) is given, and splits it into
+    train, validation and test graphs with RandomLinkSplit.
+    The split is drawn from the global random state, so seed it before calling.
+    Returns the full graph and the three splits.
+    """
+    import torch_geometric.transforms as pyg_T
+
+    if data is None:
+        print("Load data")
+        if args.randomize_ppi:
+            print("Not Using Protein-Protein Interactions")
+        if args.randomize_dpi:
+            print("Not Using Drug-Protein Interactions")
+        data = load_data(args.randomize_ppi, args.randomize_dpi, min_side_effect_edges=args.min_se_edges)
     edge_types = data.edge_types
     rev_edge_types = []
 
@@ -54,15 +156,16 @@ def run_experiment(seed, args):
         pyg_T.AddSelfLoops(),
         pyg_T.RandomLinkSplit(num_val=0.1, num_test=0.1, is_undirected=True,
                               edge_types=edge_types, rev_edge_types=rev_edge_types,
-                              neg_sampling_ratio=0.0, disjoint_train_ratio=0.2)])
+                              neg_sampling_ratio=0.0, disjoint_train_ratio=args.disjoint_train_ratio)])
 
     train_data, valid_data, test_data = transform(data)
     # data split into train, valid, test (each one is a object describing a heterogeneous graph)
 
+    dtype = DTYPES[args.dtype]
     for node in data.node_types:
-        train_data[node].x = train_data[node].x.to_sparse().double()
-        valid_data[node].x = valid_data[node].x.to_sparse().double()
-        test_data[node].x = test_data[node].x.to_sparse().double()
+        train_data[node].x = train_data[node].x.to_sparse().to(dtype)
+        valid_data[node].x = valid_data[node].x.to_sparse().to(dtype)
+        test_data[node].x = test_data[node].x.to_sparse().to(dtype)
 
     # Remove the reverse edge types from the train, validation, and test datasets
     # as they were only needed for the RandomLinkSplit transformation:
@@ -79,9 +182,23 @@ def run_experiment(seed, args):
             valid_data[edge_type].edge_index = pyg_utils.to_undirected(valid_data[edge_type].edge_index)
             test_data[edge_type].edge_index = pyg_utils.to_undirected(test_data[edge_type].edge_index)
 
-    print("Initialize model...")
-    hidden_dim = [64, 32]  # hidden dimensions of the encoder
-    num_layer = 2  # number of layers in the encoder
+    if args.prune_genes:
+        # Drug embeddings only depend on the genes within reach of the encoder; the others and the gene
+        # supervision edges are dropped from every graph
+        gene_mask = drug_receptive_field(data, len(args.hidden_dims))
+        print(f"Keeping the {int(gene_mask.sum())} of {len(gene_mask)} genes within reach of the drug embeddings")
+        data, train_data, valid_data, test_data = [prune_genes(graph, gene_mask)
+                                                   for graph in (data, train_data, valid_data, test_data)]
+    return data, train_data, valid_data, test_data
+
+
+def build_model(data, train_data, args):
+    """
+    Initializes a HeteroGAE, or a SIGNGAE with args.encoder == "sign", in the precision args.dtype (double by
+    default) for the graph and the hyperparameters in args.
+    """
+    hidden_dim = list(args.hidden_dims)  # hidden dimensions of the encoder
+    edge_types = data.edge_types
 
     # The decoder is a bilinear decoder for the "interact", "has_target", and "get_target" relations
     # and a dedicom decoder for all other relations (the drug-drug interaction relations)
@@ -96,6 +213,9 @@ def run_experiment(seed, args):
         "has_target": "bilinear",
         "get_target": "bilinear",
     }
+    if args.prune_genes:  # the gene edges of a pruned graph only pass messages
+        del decoder_2_relation["bilinear"]
+        relation_2_decoder = {}
 
     # Add the dedicom decoder for all other relations (the drug-drug interaction relations)
     for (_, relation, _) in edge_types:
@@ -104,20 +224,213 @@ def run_experiment(seed, args):
 
     # Set the output dimension, which is the same as the last hidden layer's dimension
     out_dim = hidden_dim[-1]
+    if args.encoder == "sign":
+        net = SIGNGAE(hidden_dim, out_dim, data.node_types, data.edge_types, decoder_2_relation, relation_2_decoder,
+                      dropout=args.dropout, device=args.device, cache_dir=args.sign_cache_dir).to(args.device)
+        return net.to(DTYPES[args.dtype])
     input_dim = {"drug": train_data.x_dict["drug"].shape[1], "gene": train_data.x_dict["gene"].shape[1]}
+    checkpoint_activations = None if args.checkpoint_activations == "none" else args.checkpoint_activations
     # Initialize the model
     net = HeteroGAE(hidden_dim, out_dim, data.node_types, data.edge_types, decoder_2_relation,
                     relation_2_decoder, num_bases=args.num_bases, input_dim=input_dim, dropout=args.dropout,
-                    device=args.device).to(args.device)
-    net = net.to(torch.double)
+                    device=args.device, checkpoint_activations=checkpoint_activations,
+                    checkpoint_group_size=args.checkpoint_group_size).to(args.device)
+    return net.to(DTYPES[args.dtype])
+
+
+def build_optimizer(params, args):
+    """
+    Adam, or with --lean_optimizer a LeanAdam with args.optim_state_dtype moments and factored second moments.
+    """
+    if args.lean_optimizer:
+        return LeanAdam(params, lr=args.lr, state_dtype=STATE_DTYPES[args.optim_state_dtype],
+                        factored=not args.no_factored)
+    return torch.optim.Adam(params, lr=args.lr)
+
+
+def train_step(net, optimizer, loss_fn, train_data, edge_types, device, z_dict=None, edge_labels=None,
+               before_step=None, edge_type_weight=None):
+    """
+    Runs one full-batch training step over the given edge types and returns the loss.
+    z_dict can be passed in if the encoder output for the current parameters is already available, and
+    edge_labels (edge_label_index_dict, edge_label_dict) if the batch was prepared ahead, otherwise
+    negatives are sampled here. before_step is called between the backward pass and the optimizer step.
+    If edge_type_weight is given, only the edge types in edge_types (plus "get_target") pass messages,
+    weighted as in HeteroGAE.encode; this is how a sampled subset of relations is trained.
+    """
+    net.train()  # set the model to training mode
+    optimizer.zero_grad()  # clear the gradients
+    if z_dict is None and edge_type_weight is not None:
+        edge_index_dict = {edge_type: edge_index for edge_type, edge_index in train_data.edge_index_dict.items()
+                           if edge_type in edge_types or edge_type[1] == "get_target"}
+        z_dict = net.encode(train_data.x_dict, edge_index_dict, edge_type_weight=edge_type_weight)
+    elif z_dict is None:
+        z_dict = net.encode(train_data.x_dict, train_data.edge_index_dict)  # encode the graph
+    if edge_labels is None:
+        edge_labels = sample_edge_labels(train_data, edge_types)
+    edge_label_index_dict, edge_label_dict = edge_labels
+
+    edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)  # decode the edge labels
+    edge_pred = torch.cat([edge_pred[relation] for relation in edge_pred.keys()], dim=-1)
+    edge_label = torch.cat([edge_label_dict[relation] for relation in edge_label_dict.keys()], dim=-1).to(device)
+    loss = loss_fn(edge_pred, edge_label)
+    loss.backward()
+    if before_step is not None:
+        before_step()
+    optimizer.step()
+    return loss.detach().item()
+
+
+def sample_relations(data, edge_types, num_relations, weighted, generator):
+    """
+    Samples num_relations drug-drug edge types, uniformly without replacement or, if weighted, with replacement
+    proportionally to their number of supervision edges. The gene edge types are always kept.
+    Returns the kept edge types in model order, and the weight of every sampled relation that makes the summed
+    drug messages an unbiased estimate of the sum over all relations: 1 / (num_relations * p) for uniform
+    sampling (p * num_relations is the inclusion probability), and the Hansen-Hurwitz weight
+    count / (num_relations * p) for weighted sampling, where count is the number of times a relation was drawn.
+    """
+    drug_edge_types = [edge_type for edge_type in edge_types
+                       if edge_type[1] not in ["interact", "has_target", "get_target"]]
+    if weighted:
+        prob = torch.tensor([float(data[edge_type].edge_label_index.shape[1]) for edge_type in drug_edge_types])
+    else:
+        prob = torch.ones(len(drug_edge_types))
+    prob = prob / prob.sum()
+    num_relations = min(num_relations, len(drug_edge_types))
+    sampled = torch.multinomial(prob, num_relations, replacement=weighted, generator=generator).tolist()
+    edge_type_weight = {}
+    for i in sampled:
+        edge_type_weight[drug_edge_types[i]] = edge_type_weight.get(drug_edge_types[i], 0.) + \
+            1. / (num_relations * prob[i].item())
+    kept = [edge_type for edge_type in edge_types if edge_type in edge_type_weight or edge_type not in drug_edge_types]
+    return kept, edge_type_weight
+
+
+def validate(net, valid_data, edge_types):
+    """
+    Mean validation ROC-AUC over the drug-drug side effects, with freshly sampled negatives.
+    """
+    net.eval()
+    with torch.no_grad():
+        z_dict = net.encode(valid_data.x_dict, valid_data.edge_index_dict)
+        edge_label_index_dict, edge_label_dict = sample_edge_labels(valid_data, edge_types)
+        edge_pred = predict_edge_labels(net, z_dict, edge_label_index_dict)
+        roc_auc, _, _ = cal_roc_auc_score_per_side_effect(edge_pred, edge_label_dict, edge_types)
+    return roc_auc
+
+
+def test_model(net, test_data, edge_types):
+    """
+    Scores the model on the test split: overall and per side effect AUROC, AUPRC and AP@50.
+    """
+    net.eval()
+    with torch.no_grad():
+        z_dict = net.encode(test_data.x_dict, test_data.edge_index_dict)
+        edge_label_index_dict, edge_label_dict = sample_edge_labels(test_data, edge_types)
+        edge_pred = predict_edge_labels(net, z_dict, edge_label_index_dict)
+    return score_predictions(edge_pred, edge_label_dict, edge_types)
+
+
+def rank_model(net, test_data, edge_types, block_size=4096):
+    """
+    Filtered ranking evaluation on the test split: every test pair (u, v) of a side effect is ranked against all
+    other drugs as partners of u, with the training, validation and other test pairs of that side effect (in
+    either orientation) filtered out. Unlike test_model it does not depend on sampled negatives.
+    Returns overall and per side effect MRR and Hits@1/3/10.
+    """
+    net.eval()
+    query_edge_index_dict, known_edge_index_dict = {}, {}
+    for edge_type in edge_types:
+        if edge_type[1] in ["interact", "has_target", "get_target"]:
+            continue
+        edge_label_index = test_data[edge_type].edge_label_index
+        # the self loops added before the split are not drug pairs
+        query_edge_index_dict[edge_type] = edge_label_index[:, edge_label_index[0] != edge_label_index[1]]
+        known = torch.cat([test_data[edge_type].edge_index, edge_label_index], dim=1)
+        known_edge_index_dict[edge_type] = torch.cat([known, known.flip(0)], dim=1)  # drug pairs are unordered
+    with torch.no_grad():
+        z_dict = net.encode(test_data.x_dict, test_data.edge_index_dict)
+        ranks = net.filtered_ranks(z_dict, query_edge_index_dict, known_edge_index_dict, block_size)
+    return cal_filtered_ranking_metrics(ranks)
+
+
+def score_predictions(edge_pred, edge_label_dict, edge_types):
+    """
+    Overall and per side effect AUROC, AUPRC and AP@50 of predicted probabilities keyed by relation.
+    """
+    roc_auc, roc_auc_dict, counts_dict = cal_roc_auc_score_per_side_effect(edge_pred, edge_label_dict, edge_types)
+    prec, prec_dict, counts_dict_2 = cal_average_precision_score_per_side_effect(edge_pred, edge_label_dict,
+                                                                                 edge_types)
+    apk, apk_dict = cal_apk(edge_pred, edge_label_dict, edge_types, k=50)
+    return {
+        "auroc": roc_auc,
+        "auprc": prec,
+        "ap50": apk,
+        "counts_dict_1": counts_dict,
+        "prec_dict": prec_dict,
+        "apk_dict": apk_dict,
+        "roc_auc_dict": roc_auc_dict
+    }
+
+
+def compile_model(net, data, edge_types, mode=None):
+    """
+    Replaces net.encode and net.decode_all_relation by torch.compile'd versions, after checking on data
+    that the compiled model reproduces the eager outputs. The model is run eagerly first, which also
+    initializes the lazily sized convolution weights.
+    """
+    was_training = net.training
+    net.eval()
+    with torch.no_grad():
+        z_dict = net.encode(data.x_dict, data.edge_index_dict)
+        edge_label_index_dict = {edge_type: data[edge_type].edge_label_index for edge_type in edge_types}
+        edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)
+
+        net.encode = torch.compile(net.encode, mode=mode)
+        net.decode_all_relation = torch.compile(net.decode_all_relation, mode=mode)
+        compiled_z_dict = net.encode(data.x_dict, data.edge_index_dict)
+        compiled_edge_pred = net.decode_all_relation(compiled_z_dict, edge_label_index_dict)
+    torch.testing.assert_close(compiled_z_dict, z_dict)
+    torch.testing.assert_close(compiled_edge_pred, edge_pred)
+    net.train(was_training)
+    return net
+
+
+def run_experiment(seed, args, data=None):
+
+    # parser = argparse.ArgumentParser(description="Polypharmacy Side Effect Prediction")
+    # parser.add_argument("--seed", type=int, default=1, help="random seed")
+    # parser.add_argument("--num_epoch", type=int, default=300, help="number of epochs")
+    # parser.add_argument("--lr", type=float, default=1e-3, help="learning rate")
+    # parser.add_argument("--chkpt_dir", type=str, default="./checkpoint/", help="checkpoint directory")
+    # parser.add_argument("--dropout", type=float, default=0.1, help="dropout rate")
+    # parser.add_argument("--device", type=str, default="cuda:0", help="training device")
+    # parser.add_argument("--pretrained", type=str, default=None, help="pretrained model checkpoint path")
+    # parser.add_argument("--num_bases", type=int, default=None, help="number of basis functions")
+    # parser.add_argument("--save_model", action="store_true", help="save model")
+    # parser.add_argument("--randomize_ppi", action="store_true", help="randomize protein interactions")
+    # parser.add_argument("--randomize_dpi", action="store_true", help="randomize drug protein interactions")
+    # args = parser.parse_args()
+    torch_geometric.seed_everything(seed)
+    print("Running experiment with seed: ", seed)
+    data, train_data, valid_data, test_data = prepare_split(args, data)
+    edge_types = data.edge_types
+
+    print("Initialize model...")
+    net = build_model(data, train_data, args)
 
     # Load the pre-trained model checkpoint if provided as an argument
     if args.pretrained:
         print(f"Loading pre-trained model from {args.pretrained}")
         net.load_state_dict(torch.load(args.pretrained))
 
+    if args.compile:
+        print("Compiling the encoder and decoders...")
+        compile_model(net, valid_data.to(args.device), edge_types)
+
     loss_fn = nn.BCEWithLogitsLoss(reduction="sum")
-    optimizer = torch.optim.Adam(net.parameters(), lr=args.lr)
+    optimizer = build_optimizer(net.parameters(), args)
     num_epoch = args.num_epoch
 
     print("Training device: ", args.device)
@@ -125,130 +438,126 @@ def run_experiment(seed, args):
     train_data = train_data.to(args.device)
     valid_data = valid_data.to(args.device)
     best_val_roc = 0  # best validation ROC-AUC score intialized to 0
+
+    # Without dropout the encoder is deterministic, so if validation runs message passing over the training
+    # graph the validation encode after optimizer.step() is exactly the encode the next training step needs.
+    # It is then computed once with autograd enabled and shared. With disjoint_train_ratio > 0 the training
+    # graph lacks the supervision edges that validation passes messages over, and both encodes are needed.
+    reuse_encode = args.dropout == 0 and not args.relations_per_step and \
+        shares_message_passing_graph(train_data, valid_data)
+    if reuse_encode:
+        print("Validation and training share the message-passing graph: reusing validation encodes")
+    cached_z_dict, cached_version = None, None  # encoder output kept for the next training step
     print("Training...")  # Training loop
     patience_counter = 0 # initialize the patience counter
+    val_subset = None  # fixed validation batch over a subset of relations, used to skip full validations
+    best_subset_roc = 0
+    if args.val_subset_frac < 1:
+        val_subset = generate_validation_subset(valid_data, edge_types, args.val_subset_frac,
+                                                max_edges=args.val_subset_edges, seed=seed)
+        print(f"Validating on a subset of {len(val_subset[0])} relations before each full validation")
+    def epoch_relations(epoch, generator):
+        # relations trained in this epoch and their message weights (all relations, unweighted, by default)
+        if not args.relations_per_step:
+            return edge_types, None
+        return sample_relations(train_data, edge_types, args.relations_per_step,
+                                args.relation_sampling == "weighted", generator)
+
+    prefetcher = None
+    if args.prefetch > 0:
+        # Relations and negatives of epoch t are drawn from a generator seeded with (seed, t), so the
+        # batches are the same whatever the timing of the background thread.
+        def sample_epoch(epoch):
+            generator = torch.Generator().manual_seed(seed * 1000003 + epoch)
+            step_edge_types, edge_type_weight = epoch_relations(epoch, generator)
+            edge_labels = sample_edge_labels(train_data, step_edge_types, generator=generator)
+            return step_edge_types, edge_type_weight, edge_labels
+        prefetcher = EdgeLabelPrefetcher(sample_epoch, num_epoch, depth=args.prefetch)
+    else:
+        relation_generator = torch.Generator().manual_seed(seed)
     for epoch in range(num_epoch):
         start = time.time()
-        net.train()  # set the model to training mode
-        optimizer.zero_grad()  # clear the gradients
-        z_dict = net.encode(train_data.x_dict, train_data.edge_index_dict)  # encode the graph
-        pos_edge_label_index_dict = train_data.edge_label_index_dict  # get the positive edge indices
-        edge_label_index_dict = {}  # initialize the dictionary for the edge indices
-        edge_label_dict = {}  # initialize the dictionary for the edge labels
-        for edge_type in edge_types:  # for each edge type
-            src, relation, dst = edge_type  # get the source, relation, and destination node types
-            if relation == "get_target":  # skip the "get_target" relation
-                continue
-            #
-            num_nodes = (train_data.x_dict[src].shape[0], train_data.x_dict[dst].shape[0])
-            neg_edge_label_index = pyg_utils.negative_sampling(pos_edge_label_index_dict[edge_type],
-                                                               num_nodes=num_nodes)
-            # negative sampling for the edge indices
-            edge_label_index_dict[edge_type] = torch.cat([pos_edge_label_index_dict[edge_type],
-                                                          neg_edge_label_index], dim=-1)
-
-            pos_label = torch.ones(pos_edge_label_index_dict[edge_type].shape[1])  # positive edge labels
-            neg_label = torch.zeros(neg_edge_label_index.shape[1])  # negative edge labels
-            edge_label_dict[relation] = torch.cat([pos_label, neg_label], dim=0)  # concatenate the edge labels
-
-        edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)  # decode the edge labels
-        edge_pred = torch.cat([edge_pred[relation] for relation in edge_pred.keys()], dim=-1)
-        edge_label = torch.cat([edge_label_dict[relation] for relation in edge_label_dict.keys()], dim=-1).to(
-            args.device)
-        loss = loss_fn(edge_pred, edge_label)
-        loss.backward()
-        optimizer.step()
-        loss = loss.detach().item()
+        z_dict = None
+        if cached_z_dict is not None and cached_version == parameter_version(net):
+            z_dict = cached_z_dict  # computed by the last validation with the current parameters
+        cached_z_dict = None
+        if prefetcher is not None:
+            step_edge_types, edge_type_weight, edge_labels = prefetcher.get(epoch)
+        else:
+            (step_edge_types, edge_type_weight), edge_labels = epoch_relations(epoch, relation_generator), None
+        loss = train_step(net, optimizer, loss_fn, train_data, step_edge_types, args.device, z_dict=z_dict,
+                          edge_labels=edge_labels, edge_type_weight=edge_type_weight)
+        if args.memory_report and epoch == 0:
+            print_memory_report(memory_report(net, optimizer))
+
+        if (epoch + 1) % args.val_every != 0 and epoch < num_epoch - 1:  # always validate the last epoch
+            end = time.time()
+            print(f"| Epoch: {epoch} | Loss: {loss} | Time: {end - start}")
+            continue
 
         net.eval()
+        if reuse_encode:
+            cached_z_dict = net.encode(valid_data.x_dict, valid_data.edge_index_dict)
+            cached_version = parameter_version(net)
+            z_dict = {key: x.detach() for key, x in cached_z_dict.items()}
         with torch.no_grad():
-            z_dict = net.encode(valid_data.x_dict, valid_data.edge_index_dict)
-            pos_edge_label_index_dict = valid_data.edge_label_index_dict
-            edge_label_index_dict = {}
-            edge_label_dict = {}
-            for edge_type in edge_types:
-                src, relation, dst = edge_type
-                if relation == "get_target":
-                    continue
-                num_nodes = (train_data.x_dict[src].shape[0], train_data.x_dict[dst].shape[0])
-                neg_edge_label_index = pyg_utils.negative_sampling(pos_edge_label_index_dict[edge_type],
-                                                                   num_nodes=num_nodes)
-                edge_label_index_dict[edge_type] = torch.cat([pos_edge_label_index_dict[edge_type],
-                                                              neg_edge_label_index], dim=-1)
-
-                pos_label = torch.ones(pos_edge_label_index_dict[edge_type].shape[1])
-                neg_label = torch.zeros(neg_edge_label_index.shape[1])
-                edge_label_dict[relation] = torch.cat([pos_label, neg_label], dim=0)
-
-            edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)
-            for relation in edge_pred.keys():
-                edge_pred[relation] = F.sigmoid(edge_pred[relation]).cpu()
-            roc_auc, roc_auc_dict_, counts_dict_ = cal_roc_auc_score_per_side_effect(edge_pred, edge_label_dict,
-                                                                                   edge_types)
+            if not reuse_encode:
+                z_dict = net.encode(valid_data.x_dict, valid_data.edge_index_dict)
+            if val_subset is not None:
+                # Cheap check first: the full validation is only run if the subset score improves.
+                subset_edge_types, subset_edge_label_index_dict, subset_edge_label_dict = val_subset
+                edge_pred = predict_edge_labels(net, z_dict, subset_edge_label_index_dict)
+                subset_roc, _, _ = cal_roc_auc_score_per_side_effect(edge_pred, subset_edge_label_dict,
+                                                                     subset_edge_types)
+                escalate = best_subset_roc < subset_roc
+                best_subset_roc = max(best_subset_roc, subset_roc)
+            else:
+                subset_roc, escalate = None, True
+
+            roc_auc = None
+            if escalate:
+                edge_label_index_dict, edge_label_dict = sample_edge_labels(valid_data, edge_types)
+                edge_pred = predict_edge_labels(net, z_dict, edge_label_index_dict)
+                roc_auc, roc_auc_dict_, counts_dict_ = cal_roc_auc_score_per_side_effect(edge_pred, edge_label_dict,
+                                                                                       edge_types)
 
         end = time.time()
-        print(f"| Epoch: {epoch} | Loss: {loss} | Val ROC: {roc_auc} | Best ROC: {best_val_roc} | Time: {end - start}")
+        subset_log = f" | Subset Val ROC: {subset_roc}" if subset_roc is not None else ""
+        print(f"| Epoch: {epoch} | Loss: {loss}{subset_log} | Val ROC: {roc_auc} | Best ROC: {best_val_roc} "
+              f"| Time: {end - start}")
 
-        if best_val_roc < roc_auc:
+        if roc_auc is not None and best_val_roc < roc_auc:
             best_val_roc = roc_auc
             patience_counter = 0
             torch.save(net.state_dict(), args.chkpt_dir + f"/gae_{seed}.pt")
             print("---- Save Model ----")
         else:
-            patience_counter += 1
+            # patience is counted either in epochs or in validation events
+            patience_counter += args.val_every if args.patience_unit == "epoch" else 1
             print("patience counter: {}".format(patience_counter))
 
         if patience_counter >= args.patience and epoch > 50:
-            print("Early stopping due to no improvement in validation ROC-AUC score for {} epochs".format(args.patience))
+            print("Early stopping due to no improvement in validation ROC-AUC score for {} {}s".format(
+                args.patience, args.patience_unit))
             break
+    if prefetcher is not None:
+        prefetcher.close()
 
     test_data = test_data.to(args.device)
     net.load_state_dict(torch.load(args.chkpt_dir + f"/gae_{seed}.pt"))
-    net.eval()
-    with torch.no_grad():
-        z_dict = net.encode(test_data.x_dict, test_data.edge_index_dict)
-        pos_edge_label_index_dict = test_data.edge_label_index_dict
-        edge_label_index_dict = {}
-        edge_label_dict = {}
-        for edge_type in test_data.edge_label_index_dict.keys():
-            src, relation, dst = edge_type
-            if relation == "get_target":
-                continue
-            num_nodes = (test_data.x_dict[src].shape[0], test_data.x_dict[dst].shape[0])
-            neg_edge_label_index = pyg_utils.negative_sampling(pos_edge_label_index_dict[edge_type],
-                                                               num_nodes=num_nodes)
-            edge_label_index_dict[edge_type] = torch.cat([pos_edge_label_index_dict[edge_type],
-                                                          neg_edge_label_index], dim=-1)
-
-            pos_label = torch.ones(pos_edge_label_index_dict[edge_type].shape[1])
-            neg_label = torch.zeros(neg_edge_label_index.shape[1])
-            edge_label_dict[relation] = torch.cat([pos_label, neg_label], dim=0)
-
-        edge_pred = net.decode_all_relation(z_dict, edge_label_index_dict)
-        for relation in edge_pred.keys():
-            edge_pred[relation] = F.sigmoid(edge_pred[relation]).cpu()
-        roc_auc, roc_auc_dict, counts_dict = cal_roc_auc_score_per_side_effect(edge_pred, edge_label_dict, edge_types)
-        prec, prec_dict, counts_dict_2 = cal_average_precision_score_per_side_effect(edge_pred, edge_label_dict,
-                                                                                     edge_types)
-        apk, apk_dict = cal_apk(edge_pred, edge_label_dict, edge_types, k=50)
-        print("-" * 100)
-        print()
-        print(f'| Test AUROC: {roc_auc} | Test AUPRC: {prec} | Test AP@50: {apk}')
+    result = test_model(net, test_data, edge_types)
+    print("-" * 100)
+    print()
+    print(f'| Test AUROC: {result["auroc"]} | Test AUPRC: {result["auprc"]} | Test AP@50: {result["ap50"]}')
+    if args.ranking_eval:
+        start = time.time()
+        result.update(rank_model(net, test_data, edge_types, args.ranking_block_size))
+        print(f'| Test MRR: {result["mrr"]} | Hits@1: {result["hits1"]} | Hits@3: {result["hits3"]} '
+              f'| Hits@10: {result["hits10"]} | Ranking time: {time.time() - start}')
 
     # Comment out the following line if you want to keep the best model
     # model_path = args.chkpt_dir + f"/gae_{seed}.pt"
     # if os.path.exists(model_path) :
     #     os.remove(model_path)
     #     print("---- Deleted Best Model ----")
-    return {
-        "seed": seed,
-        "auroc": roc_auc,
-        "auprc": prec,
-        "ap50": apk,
-        "counts_dict_1": counts_dict,
-        "prec_dict": prec_dict,
-        "apk_dict": apk_dict,
-        "roc_auc_dict": roc_auc_dict
-    }
-
-
+    return {"seed": seed, **result}
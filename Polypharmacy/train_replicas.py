@@ -0,0 +1,199 @@
+# train_replicas.py
+
+import argparse
+import time
+import types
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch_geometric
+from torch.func import functional_call, stack_module_state, vmap
+from torch_geometric.nn.dense.linear import Linear
+
+from main_gae import build_parser
+from metrics import cal_roc_auc_score_per_side_effect
+from results_store import append_results, run_config
+from train_hetero_gae import prepare_split, build_model, build_optimizer, sample_edge_labels, test_model
+
+
+class EdgeLogits(nn.Module):
+    """
+    Encoder and decoders of a HeteroGAE as a single module call, for torch.func.functional_call.
+    Returns the logits of all label edges, concatenated in the order of edge_label_index_dict.
+    """
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x_dict, edge_index_dict, edge_label_index_dict):
+        z_dict = self.net.encode(x_dict, edge_index_dict)
+        edge_pred = self.net.decode_all_relation(z_dict, edge_label_index_dict)
+        return torch.cat([edge_pred[relation] for relation in edge_pred.keys()], dim=-1)
+
+
+def sparse_linear_forward(self, x):
+    """
+    Linear.forward that multiplies sparse inputs with torch.sparse.mm, which vmap supports for a batched weight
+    (F.linear on a sparse input does not).
+    """
+    if x.is_sparse:
+        out = torch.sparse.mm(x, self.weight.t())
+        return out if self.bias is None else out + self.bias
+    return F.linear(x, self.weight, self.bias)
+
+
+class StackedReplicas:
+    """
+    K HeteroGAE replicas of identical architecture whose parameters are stacked along a leading dimension, so
+    their forward and backward passes run as one vmapped computation over shared inputs.
+
+    The replicas hold the stacked parameters; nets[k] is only used as a container to test or save replica k.
+    The first replica's modules run the vmapped computation, and their Linear layers are switched to
+    sparse_linear_forward so the sparse one-hot node features never have to be densified.
+    """
+
+    def __init__(self, nets):
+        self.nets = nets
+        self.modules = [EdgeLogits(net) for net in nets]
+        self.params, self.buffers = stack_module_state(self.modules)
+        for module in self.modules[0].modules():
+            if isinstance(module, Linear):
+                module.forward = types.MethodType(sparse_linear_forward, module)
+
+    def __len__(self):
+        return len(self.nets)
+
+    def logits(self, data, edge_label_index_dict, training):
+        """
+        (K, num_label_edges) logits of every replica, with independent dropout masks during training.
+        """
+        base = self.modules[0]
+        base.train(training)
+
+        def forward(params, buffers):
+            return functional_call(base, (params, buffers),
+                                   (data.x_dict, data.edge_index_dict, edge_label_index_dict))
+
+        return vmap(forward, randomness="different" if training else "error")(self.params, self.buffers)
+
+    def state_dict(self, replica):
+        """
+        State dict of replica k, loadable into a HeteroGAE (and by evaluate_checkpoints.py).
+        """
+        state = {**self.params, **self.buffers}
+        return {name[len("net."):]: value[replica].detach().clone() for name, value in state.items()}
+
+
+def stacked_train_step(replicas, optimizer, train_data, edge_types):
+    """
+    One full-batch training step of all replicas on the same negatives. The replicas are independent, so
+    backpropagating the sum of their losses gives every replica its own gradient.
+    Returns the loss of every replica.
+    """
+    optimizer.zero_grad()
+    edge_label_index_dict, edge_label_dict = sample_edge_labels(train_data, edge_types)
+    logits = replicas.logits(train_data, edge_label_index_dict, training=True)
+    edge_label = torch.cat([edge_label_dict[relation] for relation in edge_label_dict.keys()], dim=-1)
+    loss = F.binary_cross_entropy_with_logits(logits, edge_label.to(logits).expand_as(logits),
+                                              reduction="none").sum(dim=-1)
+    loss.sum().backward()
+    optimizer.step()
+    return loss.detach().tolist()
+
+
+def stacked_validate(replicas, valid_data, edge_types):
+    """
+    Validation ROC-AUC of every replica, on one shared set of validation negatives.
+    """
+    edge_types = [edge_type for edge_type in edge_types
+                  if edge_type[1] not in ["interact", "has_target", "get_target"]]
+    with torch.no_grad():
+        edge_label_index_dict, edge_label_dict = sample_edge_labels(valid_data, edge_types)
+        preds = replicas.logits(valid_data, edge_label_index_dict, training=False).sigmoid().cpu()
+    sizes = [edge_label_index_dict[edge_type].shape[1] for edge_type in edge_types]
+    relations = [relation for (_, relation, _) in edge_types]
+    return [cal_roc_auc_score_per_side_effect(dict(zip(relations, pred.split(sizes))), edge_label_dict,
+                                              edge_types)[0] for pred in preds]
+
+
+def build_replicas(data, train_data, seeds, args):
+    """
+    One replica per seed, each initialized as run_experiment would for that seed.
+    """
+    nets = []
+    for seed in seeds:
+        torch_geometric.seed_everything(seed)
+        net = build_model(data, train_data, args)
+        with torch.no_grad():  # initialize the lazily sized weights before stacking
+            net.eval()
+            net.encode(train_data.x_dict, train_data.edge_index_dict)
+        nets.append(net)
+    return StackedReplicas(nets)
+
+
+def run_replicas(args):
+    """
+    Trains args.num_replicas replicas on the split of args.seed, replica k initialized with seed args.seed + k.
+
+    The split, the negatives of every step and the validation negatives are shared; every replica has its own
+    early stopping and checkpoint (gae_{seed}_replica{k}.pt). A replica that stopped keeps being computed as
+    part of the stack, without further validation, until all replicas have stopped.
+    Results are stored with the split seed as seed, and the replica and its initialization seed in their own
+    columns; num_replicas is part of the config, so they are not averaged with run_experiment runs.
+    Options of run_experiment that change the step itself (val subsets, prefetch, relation sampling,
+    compile, activation checkpointing) are not applied here.
+    """
+    torch_geometric.seed_everything(args.seed)
+    data, train_data, valid_data, test_data = prepare_split(args)
+    edge_types = data.edge_types
+    seeds = [args.seed + replica for replica in range(args.num_replicas)]
+    replicas = build_replicas(data, train_data, seeds, args)
+    optimizer = build_optimizer(replicas.params.values(), args)
+    torch_geometric.seed_everything(args.seed)
+
+    best_val_roc = [0] * len(replicas)
+    patience_counter = [0] * len(replicas)
+    active = [True] * len(replicas)
+    for epoch in range(args.num_epoch):
+        start = time.time()
+        loss = stacked_train_step(replicas, optimizer, train_data, edge_types)
+        val_roc = stacked_validate(replicas, valid_data, edge_types)
+        for replica in range(len(replicas)):
+            if not active[replica]:
+                continue
+            if best_val_roc[replica] < val_roc[replica]:
+                best_val_roc[replica] = val_roc[replica]
+                patience_counter[replica] = 0
+                torch.save(replicas.state_dict(replica), args.chkpt_dir + f"/gae_{args.seed}_replica{replica}.pt")
+            else:
+                patience_counter[replica] += 1
+            if patience_counter[replica] >= args.patience and epoch > 50:
+                active[replica] = False
+                print(f"Replica {replica}: early stopping after epoch {epoch}, best Val ROC {best_val_roc[replica]}")
+        print(f"| Epoch: {epoch} | Loss: {[round(value, 4) for value in loss]} "
+              f"| Val ROC: {[round(value, 4) for value in val_roc]} | Active: {sum(active)} "
+              f"| Time: {time.time() - start}")
+        if not any(active):
+            break
+
+    results = []
+    for replica, (net, seed) in enumerate(zip(replicas.nets, seeds)):
+        net.load_state_dict(torch.load(args.chkpt_dir + f"/gae_{args.seed}_replica{replica}.pt"))
+        result = {"seed": args.seed, "init_seed": seed, "replica": replica, **test_model(net, test_data, edge_types)}
+        append_results(args.results_dir, result, run_config(args))
+        print(f'| Replica {replica} | Test AUROC: {result["auroc"]} | Test AUPRC: {result["auprc"]} '
+              f'| Test AP@50: {result["ap50"]}')
+        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train several seeds as one stacked, vmapped model",
+                                     parents=[build_parser(add_help=False)])
+    parser.add_argument("--num_replicas", type=int, default=4, help="number of replicas trained together")
+    args = parser.parse_args()
+    if args.num_bases is not None:
+        parser.error("--num_bases models cannot be stacked (the basis weights are not registered parameters)")
+    run_replicas(args)
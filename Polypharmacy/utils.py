@@ -1,38 +1,27 @@
-from sklearn.datasets import fetch_20newsgroups
-import torch
 # from tdc.chem_utils import featurize
 from collections import defaultdict
 from typing import DefaultDict
-import pandas as pd
-import numpy as np
-import networkx as nx
-import json
-import pickle
-from sklearn.decomposition import PCA
-import pandas as pd
-import numpy as np
+
+# torch, numpy, pandas and networkx are imported inside the functions that need them, so importing this
+# module (e.g. for the data paths in data.py) does not pay for loading them.
 
 
 def randomize_dataframe_col2_values(df, col_randomize):
     """
     Randomizes the values in col2 of a dataframe while keeping the values in col1 the same.
     Used for randomizing the values in the drug-drug interaction dataset and drug-protein interaction dataset.
+    The rows are shuffled with a single permutation and col_randomize keeps its original order; df is not modified.
+    See null_models.NullGraphReplicates to draw many randomized graphs at once.
     """
-    # Create a new column containing a random order of row indices
-    print(df.head(3))
-    df['random_order'] = np.random.permutation(len(df))
+    import numpy as np
     print("Randomizing column: ", col_randomize, "...")
-    # Sort the dataframe by the new column
-    df_randomized = df.sort_values('random_order')
-
-    # Reset the index of the randomized dataframe
-    df_randomized = df_randomized.reset_index(drop=True)
-
-    # Replace the values in col2 of the randomized dataframe with the corresponding values in col2 of the original dataframe
-    df_randomized[col_randomize] = df[col_randomize]
-    # Delete the random_order column
-    df_randomized = df_randomized.drop(columns=['random_order'])
-    print(df_randomized.head(3))
+    # Same draw as sorting the rows by a random_order column: row i moves to position random_order[i]
+    random_order = np.random.permutation(len(df))
+    rows = np.empty_like(random_order)
+    rows[random_order] = np.arange(len(df))
+    df_randomized = df.iloc[rows].reset_index(drop=True)
+    # Replace the values in col2 of the randomized dataframe with the values of the original dataframe
+    df_randomized[col_randomize] = df[col_randomize].to_numpy()
     print('Done randomizing column: ', col_randomize, '!')
     return df_randomized
 
@@ -41,6 +30,8 @@ def load_ppi(filepath="bio-decagon-ppi/bio-decagon-ppi.csv", randomize_ppi=False
     """
      Loads the protein-protein interaction graph from the Bio-decagon dataset.
     """
+    import networkx as nx
+    import pandas as pd
     df = pd.read_csv(filepath)
     if randomize_ppi:
         df = randomize_dataframe_col2_values(df, "Gene 2")
@@ -64,6 +55,7 @@ def load_targets(filepath="bio-decagon-targets/bio-decagon-targets.csv", randomi
     """
         Loads the drug-target interaction graph from the Bio-decagon dataset.
     """
+    import pandas as pd
     df = pd.read_csv(filepath)
     if randomize_dpi:
         df = randomize_dataframe_col2_values(df, "Gene")
@@ -84,6 +76,7 @@ def load_categories(filepath="bio-decagon-effectcategories/bio-decagon-effectcat
     """
         Loads the side effect categories from the Bio-decagon dataset.
     """
+    import pandas as pd
     df = pd.read_csv(filepath)
 
     side_effects = df["Side Effect"]
@@ -110,6 +103,7 @@ def load_combo_side_effect(filepath="bio-decagon-combo/bio-decagon-combo.csv"):
         combo_2_stitch containing drug combinations and their drugs,
         stitch_2_idx containing drugs and their unique indices.
     """
+    import pandas as pd
     df = pd.read_csv(filepath)
     print("Load Combination Side Effect Graph")
     combo_2_side_effect = defaultdict(set)   # drug combination -> side effect
@@ -152,26 +146,28 @@ def load_combo_side_effect(filepath="bio-decagon-combo/bio-decagon-combo.csv"):
     return combo_2_side_effect, side_effect_2_combo, side_effect_2_name, combo_2_stitch, stitch_2_idx
 
 
-def convert_combo_side_effect_to_edge_index_list(side_effect_2_combo, combo_2_stitch, stitch_2_idx):
+def convert_combo_side_effect_to_edge_index_list(side_effect_2_combo, combo_2_stitch, stitch_2_idx, min_edges=500):
     """
     Input: side_effect_2_combo: Containing side effects and their drug combinations,
     combo_2_stitch: containing drug combinations and their drugs,
-    stitch_2_idx: containing drugs and their unique indices.
+    stitch_2_idx: containing drugs and their unique indices,
+    min_edges: side effects with fewer drug combinations are dropped.
 
     Returns: stitch_2_idx: containing drugs and their unique indices,
     edge_index_dict: maps side effects types to their drug combinations
     This code is building a dictionary called edge_index_dict that represents the edge indices in a graph,
     where the nodes are drugs and the edges represent the side effects between the drug pairs.
     """
+    import torch
     edge_index_dict = defaultdict(list)
     for se in side_effect_2_combo.keys():  # loop through all the side effects
         for combo in side_effect_2_combo[se]:  # loop through all the drug combinations for each side effect
             s1, s2 = combo_2_stitch[combo]  # get the drugs for each drug combination
             edge_index_dict[("drug", se, "drug")].append([stitch_2_idx[s1], stitch_2_idx[s2]])
 
-        if len(edge_index_dict[("drug", se, "drug")]) < 500:
+        if len(edge_index_dict[("drug", se, "drug")]) < min_edges:
             del edge_index_dict[("drug", se, "drug")]
-            # delete the side effect if the number of interactions is less than 500
+            # delete the side effect if the number of interactions is less than min_edges
         else:
             # convert the edge indices to tensor
             edge_index_dict[("drug", se, "drug")] = torch.tensor(edge_index_dict[("drug", se, "drug")]).long().T
@@ -182,6 +178,7 @@ def convert_combo_side_effect_to_edge_index_list(side_effect_2_combo, combo_2_st
 
 
 def load_mono_side_effect(filepath="bio-decagon-mono/bio-decagon-mono.csv"):
+    import pandas as pd
     df = pd.read_csv(filepath)
     print("Load Mono Side Effect\n")
     stitch_ids = df["STITCH"]
@@ -202,6 +199,7 @@ def load_mono_side_effect(filepath="bio-decagon-mono/bio-decagon-mono.csv"):
 
 
 def generate_morgan_fingerprint(stitch_2_smile, stitch_2_idx):
+    import numpy as np
     num_drugs = len(stitch_2_idx)
     x = np.identity(num_drugs)
     features = [0 for i in range(num_drugs)]